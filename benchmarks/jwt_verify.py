@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+import argparse
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ISSUER = "https://bench.local/"
+
+os.environ.setdefault("AUTH0_ISSUER", ISSUER)
+os.environ.setdefault("AUTH0_JWKS_URI", "http://127.0.0.1:9/.well-known/jwks.json")
+sys.path.insert(0, os.path.join(ROOT, "reservation"))
+
+from app.auth import TokenVerifier  # noqa: E402
+
+
+def make_tokens(private_key, count: int) -> list[str]:
+    exp = int(time.time()) + 3600
+    return [
+        jwt.encode({"sub": f"user{i}", "iss": ISSUER, "exp": exp}, private_key, algorithm="RS256",
+                   headers={"kid": "bench"})
+        for i in range(count)
+    ]
+
+
+def verify_uncached(tokens: list[str], public_key, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for token in tokens:
+            jwt.get_unverified_header(token)
+            jwt.decode(token, public_key, algorithms=["RS256"], issuer=ISSUER,
+                       options={"require": ["exp", "iss"], "verify_aud": False})
+    return time.perf_counter() - start
+
+
+def verify_cached(tokens: list[str], public_key, rounds: int) -> float:
+    verifier = TokenVerifier(os.environ["AUTH0_JWKS_URI"], ISSUER)
+    verifier.keys = {"bench": public_key}
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for token in tokens:
+            verifier.verify(token)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JWT verification throughput")
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=40)
+    args = parser.parse_args()
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    tokens = make_tokens(private_key, args.tokens)
+    total = args.tokens * args.rounds
+
+    for name, func in (("uncached", verify_uncached), ("cached", verify_cached)):
+        elapsed = func(tokens, private_key.public_key(), args.rounds)
+        print(f"{name:>9}: {total / elapsed:12.0f} verifies/s ({total} verifies in {elapsed:.3f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import logging
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Stands in for the RabbitMQ worker in the offline load test: tasks are taken straight from the gateway's
+# outbox and run through the consumer's handle_task, so sagas, compensations and loyalty replays are exercised.
+os.environ.setdefault("CONSUMER_METRICS_PORT", "0")
+sys.path.insert(0, os.path.join(ROOT, "gateway"))
+
+from app.clients import start_client, close_client  # noqa: E402
+from app.consumer import handle_task, PermanentError  # noqa: E402
+from app.outbox import Outbox  # noqa: E402
+
+log = logging.getLogger("outbox-worker")
+
+
+class OutboxWorker:
+    def __init__(self, outbox: Outbox, concurrency: int, max_attempts: int, batch_size: int, idle_wait: float):
+        self.outbox = outbox
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.max_attempts = max_attempts
+        self.batch_size = batch_size
+        self.idle_wait = idle_wait
+        self.attempts = {}
+        self.counts = {"ack": 0, "retry": 0, "dead": 0}
+        self.stopping = asyncio.Event()
+
+    async def run_one(self, message_id: int, body: bytes) -> bool:
+        attempt = self.attempts.get(message_id, 0) + 1
+        async with self.semaphore:
+            try:
+                await handle_task(json.loads(body), attempt >= self.max_attempts)
+                outcome = "ack"
+            except (PermanentError, ValueError) as e:
+                log.warning("Task %s dropped: %s", message_id, e)
+                outcome = "dead"
+            except Exception as e:
+                outcome = "retry" if attempt < self.max_attempts else "dead"
+                log.warning("Task %s attempt %s failed (%s): %s", message_id, attempt, outcome, e)
+
+        self.counts[outcome] += 1
+        if outcome == "retry":
+            self.attempts[message_id] = attempt
+            return False
+        self.attempts.pop(message_id, None)
+        return True
+
+    async def run(self):
+        while not self.stopping.is_set():
+            batch = self.outbox.fetch(self.batch_size)
+            results = await asyncio.gather(*(self.run_one(message_id, body) for message_id, body in batch))
+            self.outbox.remove([message_id for (message_id, _), done in zip(batch, results) if done])
+            if not batch or not all(results):
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), self.idle_wait)
+                except asyncio.TimeoutError:
+                    pass
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Drain the gateway outbox without a broker")
+    parser.add_argument("--outbox", default=os.getenv("OUTBOX_PATH", "outbox.db"))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--idle-wait", type=float, default=0.05)
+    args = parser.parse_args()
+
+    worker = OutboxWorker(Outbox(args.outbox), args.concurrency, args.max_attempts, args.batch_size, args.idle_wait)
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, worker.stopping.set)
+    loop.add_signal_handler(signal.SIGINT, worker.stopping.set)
+
+    await start_client()
+    start = time.monotonic()
+    try:
+        await worker.run()
+    finally:
+        await close_client()
+        worker.outbox.close()
+        print(f"outbox worker: {worker.counts} in {time.monotonic() - start:.1f}s", flush=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import tempfile
+from datetime import date, timedelta
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for key, value in {
+    "AUTH0_ISSUER": "https://bench.local/",
+    "AUTH0_JWKS_URI": "http://127.0.0.1:9/.well-known/jwks.json",
+    "AUTH0_CLIENT_ID": "bench",
+    "AUTH0_CLIENT_SECRET": "bench",
+    "AUTH0_DOMAIN": "bench.local",
+    "AUTH0_AUDIENCE": "bench",
+    "RABBITMQ_HOST": "127.0.0.1",
+    "RABBITMQ_PORT": "9",
+    "RABBITMQ_USER": "bench",
+    "RABBITMQ_PASSWORD": "bench",
+    "OUTBOX_PATH": os.path.join(tempfile.mkdtemp(prefix="bench-outbox-"), "outbox.db"),
+    "LOG_LEVEL": "WARNING",
+}.items():
+    os.environ.setdefault(key, value)
+sys.path.insert(0, os.path.join(ROOT, "gateway"))
+
+from fastapi import APIRouter, Depends, FastAPI, Request  # noqa: E402
+from fastapi.responses import JSONResponse, StreamingResponse  # noqa: E402
+from app import api, responses  # noqa: E402
+from app.auth import verifier, verify_jwt  # noqa: E402
+from app.models import (GetHotelsQuery, HotelInfo, HotelResponse, PaginationResponse, PaymentInfo, PaymentStatus,  # noqa: E402
+                        ReservationResponse)
+
+
+def make_hotels(count: int) -> dict:
+    return {
+        "total": 100000,
+        "items": [
+            {"hotelUid": str(uuid.uuid4()), "name": f"Hotel {i}", "country": "Россия", "city": "Москва",
+             "address": f"Неглинная ул., {i}", "stars": 1 + i % 5, "price": 1000 + i * 10}
+            for i in range(count)
+        ],
+        "nextCursor": "MTAw",
+    }
+
+
+def make_reservation_pages(count: int, page_size: int) -> tuple[dict, dict]:
+    start = date(2026, 1, 1)
+    reservations, payments = [], {}
+    for i in range(count):
+        payment_uid = str(uuid.uuid4())
+        payments[payment_uid] = {"paymentUid": payment_uid, "status": "PAID", "price": 10000 + i}
+        reservations.append({
+            "reservationUid": str(uuid.uuid4()),
+            "hotel": {"hotelUid": str(uuid.uuid4()), "name": f"Hotel {i}",
+                      "fullAddress": f"Россия, Москва, Неглинная ул., {i}", "stars": 5},
+            "startDate": f"{start + timedelta(days=i % 300)}T00:00:00+00:00",
+            "endDate": f"{start + timedelta(days=i % 300 + 3)}T00:00:00+00:00",
+            "status": "PAID",
+            "paymentUid": payment_uid,
+        })
+
+    pages = {}
+    for n, offset in enumerate(range(0, count, page_size)):
+        cursor = None if offset == 0 else str(n)
+        has_next = offset + page_size < count
+        pages[cursor] = {"reservations": reservations[offset:offset + page_size],
+                         "nextCursor": str(n + 1) if has_next else None}
+    return pages, payments
+
+
+def install_fakes(hotels: dict, pages: dict, payments: dict):
+    async def fetch_hotels(page, size, auth, cursor=None):
+        return hotels
+
+    async def fetch_user_reservations_page(auth, cursor=None, size=None):
+        return pages[cursor]
+
+    async def fetch_payments_bulk(payment_uids, auth):
+        return {uid: payments[uid] for uid in payment_uids}
+
+    async def fetch_user_loyalty(auth):
+        return {"status": "GOLD", "discount": 10, "reservationCount": 25}
+
+    api.fetch_hotels = fetch_hotels
+    api.fetch_user_reservations_page = fetch_user_reservations_page
+    api.fetch_payments_bulk = fetch_payments_bulk
+    api.fetch_user_loyalty = fetch_user_loyalty
+
+
+def legacy_router() -> APIRouter:
+    # The handlers as they were before the fast path: a model per item, response_model re-validation,
+    # stdlib json for the final body and one model_dump_json per streamed reservation.
+    router = APIRouter(dependencies=[Depends(verify_jwt)])
+
+    async def reservations_with_payments(reservations_data: list[dict], auth):
+        payment_uids = [reservation["paymentUid"] for reservation in reservations_data]
+        payments = await api.handle_service_errors("payment", api.fetch_payments_bulk, payment_uids, auth,
+                                                   fallback=True) or {}
+        result = []
+        for reservation in reservations_data:
+            payment = payments.get(str(reservation["paymentUid"]))
+            result.append(ReservationResponse(
+                reservationUid=reservation["reservationUid"],
+                hotel=HotelInfo(**reservation["hotel"]),
+                startDate=reservation["startDate"][:10],
+                endDate=reservation["endDate"][:10],
+                status=reservation["status"],
+                payment=PaymentInfo(status=PaymentStatus(payment["status"]), price=payment["price"]) if payment else None,
+            ))
+        return result
+
+    async def stream(page: dict, auth, loyalty: dict):
+        yield b'{"reservations":['
+        first = True
+        while True:
+            reservations = await reservations_with_payments(page["reservations"], auth)
+            chunk = b",".join(r.model_dump_json().encode() for r in reservations)
+            yield chunk if first else b"," + chunk
+            first = False
+            if not page["nextCursor"]:
+                break
+            page = await api.handle_service_errors("reservation", api.fetch_user_reservations_page, auth,
+                                                   page["nextCursor"])
+        yield b'],"loyalty":' + json.dumps(loyalty).encode() + b'}'
+
+    @router.get("/legacy/api/v1/hotels", response_model=PaginationResponse, response_model_exclude_none=True)
+    async def hotels(request: Request, params: GetHotelsQuery = Depends()):
+        auth = api._auth(request)
+        data = await api.handle_service_errors("reservation", api.fetch_hotels, params.page, params.size, auth,
+                                               params.cursor)
+        return PaginationResponse(
+            page=params.page,
+            pageSize=params.size,
+            totalElements=data["total"],
+            items=[HotelResponse(**h) for h in data["items"]],
+            nextCursor=data.get("nextCursor"),
+        )
+
+    @router.get("/legacy/api/v1/me")
+    async def me(request: Request):
+        auth = api._auth(request)
+        username = api._username(request)
+        first_page, loyalty = await asyncio.gather(
+            api.handle_service_errors("reservation", api.fetch_user_reservations_page, auth),
+            api._loyalty(auth, username),
+        )
+        return StreamingResponse(stream(first_page, auth, loyalty or {}), media_type="application/json")
+
+    return router
+
+
+def build_app() -> FastAPI:
+    verifier.verify = lambda token: {"sub": "bench"}
+
+    app = FastAPI(default_response_class=responses.FastJSONResponse)
+    app.include_router(api.router)
+    app.include_router(legacy_router(), default_response_class=JSONResponse)
+    return app
+
+
+async def measure(client: httpx.AsyncClient, path: str, requests: int) -> tuple[float, bytes]:
+    body = (await client.get(path)).content
+    start = time.process_time()
+    for _ in range(requests):
+        await client.get(path)
+    return (time.process_time() - start) / requests, body
+
+
+async def run(args):
+    pages, payments = make_reservation_pages(args.reservations, api.RESERVATIONS_PAGE_SIZE)
+    install_fakes(make_hotels(100), pages, payments)
+    app = build_app()
+
+    endpoints = (("/api/v1/hotels?page=1&size=100", "hotels"), ("/api/v1/me", "me"))
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench",
+                                 headers={"Authorization": "Bearer bench"}) as client:
+        print(f"{'endpoint':<10} {'mode':<10} {'cpu/request':>12} {'bytes':>9}")
+        for path, name in endpoints:
+            results = {}
+            for mode in ("legacy", "validated", "trusted"):
+                responses.RESPONSE_TRUST_DOWNSTREAM = mode == "trusted"
+                url = "/legacy" + path if mode == "legacy" else path
+                cpu, body = await measure(client, url, args.requests)
+                results[mode] = (cpu, json.loads(body))
+                line = f"{name:<10} {mode:<10} {cpu * 1e6:10.0f}us {len(body):>9}"
+                if mode != "legacy":
+                    line += f"   {results['legacy'][0] / cpu:.2f}x vs legacy"
+                print(line)
+            if any(payload != results["legacy"][1] for _, payload in results.values()):
+                print(f"{name}: response bodies differ between modes")
+                sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gateway response serialization CPU cost")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--reservations", type=int, default=1000, help="reservations returned by /api/v1/me")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
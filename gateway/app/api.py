@@ -1,11 +1,22 @@
+import asyncio
+import logging
+import os
+import httpx
+from uuid import uuid4
+from pydantic_core import to_json
 from fastapi import APIRouter, Depends, Body, HTTPException, Response, status, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from .clients import *
 from .utils import *
 from .producer import publish_task
+from .responses import dump_json, model_response
+from .deadline import without_deadline
 from .auth import verify_jwt, username_from_claims
 
 router = APIRouter(dependencies=[Depends(verify_jwt)])
 
+BOOKING_MODE = os.getenv("BOOKING_MODE", "sync")
+
 
 def _auth(request: Request) -> str | None:
     return request.headers.get("Authorization")
@@ -18,99 +29,240 @@ def _username(request: Request) -> str:
     return username_from_claims(claims)
 
 
+def _payment_info(payment_data: dict | None) -> dict | None:
+    if not payment_data:
+        return None
+    return {"status": payment_data["status"], "price": payment_data["price"]}
+
+
+def _reservation_payload(reservation: dict, payment_data: dict | None) -> dict:
+    return {
+        "reservationUid": reservation["reservationUid"],
+        "hotel": reservation["hotel"],
+        "startDate": reservation["startDate"][:10],
+        "endDate": reservation["endDate"][:10],
+        "status": reservation["status"],
+        "payment": _payment_info(payment_data),
+    }
+
+
+async def _reservations_with_payments(reservations_data: list[dict], auth: str | None) -> list[dict]:
+    payment_uids = [reservation["paymentUid"] for reservation in reservations_data]
+    payments = await handle_service_errors("payment", fetch_payments_bulk, payment_uids, auth, fallback=True) or {}
+
+    return [
+        _reservation_payload(reservation, payments.get(str(reservation["paymentUid"])))
+        for reservation in reservations_data
+    ]
+
+
+async def _loyalty(auth: str | None, username: str) -> dict:
+    try:
+        loyalty = await handle_service_errors("loyalty", fetch_user_loyalty, auth)
+    except HTTPException:
+        last_known = loyalty_last_known.get_stale(username)
+        if last_known is None:
+            return fallback_for_service("loyalty")
+        return {**last_known, "stale": True}
+
+    if loyalty:
+        loyalty_last_known.put(username, loyalty)
+    return loyalty
+
+
+async def _update_loyalty_or_publish(auth: str | None, username: str, delta: int):
+    # The direct call and the queued replay share one key, so the delta lands once even if the direct call
+    # was applied before it failed. Queued tasks carry no user credentials; the worker uses its service token.
+    task_id = str(uuid4())
+    try:
+        await handle_service_errors("loyalty", update_loyalty, auth, delta, f"task:{task_id}")
+    except Exception:
+        await publish_task({
+            "type": "update_loyalty",
+            "id": task_id,
+            "username": username,
+            "delta": delta,
+        })
+
+
+async def _cancel_payment_or_publish(payment_uid: str, auth: str | None, username: str):
+    try:
+        with without_deadline():
+            await handle_service_errors("payment", cancel_payment, payment_uid, auth)
+    except HTTPException:
+        await publish_task({
+            "type": "cancel_payment",
+            "paymentUid": str(payment_uid),
+            "username": username,
+        })
+
+
+async def _reservation_pages(page: dict, auth: str | None):
+    while True:
+        cursor = page.get("nextCursor")
+        next_page = None
+        if cursor:
+            next_page = asyncio.create_task(
+                handle_service_errors("reservation", fetch_user_reservations_page, auth, cursor))
+        try:
+            yield await _reservations_with_payments(page.get("reservations", []), auth)
+        except BaseException:
+            if next_page is not None:
+                next_page.cancel()
+            raise
+        if next_page is None:
+            return
+        page = await next_page
+
+
+async def _stream_reservations(pages, prefix: bytes, suffix: bytes, partial_suffix: bytes):
+    # The status line is already sent when later pages are fetched, so a failed page cannot become a 503 any more:
+    # the body is closed as valid JSON with partial_suffix instead.
+    yield prefix
+    first = True
+    try:
+        async for reservations in pages:
+            if not reservations:
+                continue
+            chunk = dump_json(List[ReservationResponse], reservations, trusted=True)[1:-1]
+            yield chunk if first else b"," + chunk
+            first = False
+    except Exception as e:
+        logging.warning(f"Reservation listing cut short: {e}")
+        yield partial_suffix
+        return
+    yield suffix
+
+
 @router.get("/api/v1/hotels",
             response_model=PaginationResponse,
+            response_model_exclude_none=True,
             summary="Получить список отелей")
-def get_hotels(request: Request, params: GetHotelsQuery = Depends()):
+async def get_hotels(request: Request, params: GetHotelsQuery = Depends()):
     auth = _auth(request)
-    data = handle_service_errors("reservation", fetch_hotels, params.page, params.size, auth)
-    items = [HotelResponse(**h) for h in data["items"]]
-    return PaginationResponse(
-        page=params.page,
-        pageSize=params.size,
-        totalElements=data["total"],
-        items=items,
-    )
+    data = await handle_service_errors("reservation", fetch_hotels, params.page, params.size, auth, params.cursor)
+    return model_response(PaginationResponse, {
+        "page": params.page,
+        "pageSize": params.size,
+        "totalElements": data["total"],
+        "items": data["items"],
+        "nextCursor": data.get("nextCursor"),
+    }, exclude_none=True, trusted=True)
+
+
+@router.get("/api/v1/hotels/search",
+            response_model=HotelSearchResponse,
+            response_model_exclude_none=True,
+            summary="Поиск отелей")
+async def get_hotels_search(request: Request, params: SearchHotelsQuery = Depends()):
+    auth = _auth(request)
+    data = await handle_service_errors("reservation", search_hotels, params.model_dump(mode="json"), auth)
+    return model_response(HotelSearchResponse, {
+        "pageSize": params.size,
+        "items": data["items"],
+        "nextCursor": data.get("nextCursor"),
+    }, exclude_none=True, trusted=True)
+
+
+@router.get("/api/v1/hotels/{hotelUid}/availability",
+            response_model=AvailabilityResponse,
+            summary="Свободные номера отеля на даты")
+async def get_hotel_availability(request: Request, hotelUid: UUID, params: AvailabilityQuery = Depends()):
+    auth = _auth(request)
+    try:
+        data = await fetch_availability(hotelUid, params.startDate.isoformat(), params.endDate.isoformat(), auth)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code not in (400, 404):
+            raise HTTPException(status_code=503, detail="Reservation Service unavailable")
+        raise HTTPException(status_code=e.response.status_code, detail=e.response.json().get("detail"))
+    except Exception:
+        raise HTTPException(status_code=503, detail="Reservation Service unavailable")
+    return model_response(AvailabilityResponse, data)
 
 
 @router.get(
     "/api/v1/me",
     response_model=UserInfoResponse,
     summary="Информация о пользователе")
-def get_user_info(request: Request):
+async def get_user_info(request: Request):
     auth = _auth(request)
-    reservations_data = handle_service_errors("reservation", fetch_user_reservations, auth)
-
-    loyalty = handle_service_errors("loyalty", fetch_user_loyalty, auth, fallback=True)
-    reservations: list[ReservationResponse] = []
-
-    for reservation in reservations_data.get("reservations", []):
-        payment_data = handle_service_errors("payment", fetch_payment, reservation["paymentUid"], auth, fallback=True)
-        if payment_data:
-            payment = PaymentInfo(
-                status=PaymentStatus(payment_data["status"]),
-                price=payment_data["price"])
-        else:
-            payment = payment_data
-
-        reservations.append(
-            ReservationResponse(
-                reservationUid=reservation["reservationUid"],
-                hotel=HotelInfo(**reservation["hotel"]),
-                startDate=reservation["startDate"],
-                endDate=reservation["endDate"],
-                status=reservation["status"],
-                payment=payment,
-            )
-        )
-
-    return UserInfoResponse(
-        reservations=reservations,
-        loyalty=loyalty
+    username = _username(request)
+    first_page, loyalty = await asyncio.gather(
+        handle_service_errors("reservation", fetch_user_reservations_page, auth),
+        _loyalty(auth, username),
     )
 
+    loyalty_json = to_json(loyalty or {})
+    return StreamingResponse(
+        _stream_reservations(
+            _reservation_pages(first_page, auth),
+            b'{"reservations":[',
+            b'],"loyalty":' + loyalty_json + b'}',
+            b'],"loyalty":' + loyalty_json + b',"partial":true}'),
+        media_type="application/json")
+
 
 @router.get(
     "/api/v1/reservations",
     response_model=List[ReservationResponse],
     summary="Информация по всем бронированиям пользователя")
-def get_user_reservations(request: Request):
+async def get_user_reservations(request: Request):
     auth = _auth(request)
-    reservations_data = handle_service_errors("reservation", fetch_user_reservations, auth)
-
-    reservations: list[ReservationResponse] = []
-
-    for reservation in reservations_data.get("reservations", []):
-        payment_data = handle_service_errors("payment", fetch_payment, reservation["paymentUid"], auth, fallback=True)
-        if payment_data:
-            payment_info = PaymentInfo(
-                status=PaymentStatus(payment_data["status"]),
-                price=payment_data["price"])
-        else:
-            payment_info = None
-
-        reservations.append(
-            ReservationResponse(
-                reservationUid=reservation["reservationUid"],
-                hotel=HotelInfo(**reservation["hotel"]),
-                startDate=reservation["startDate"],
-                endDate=reservation["endDate"],
-                status=reservation["status"],
-                payment=payment_info,
-            )
-        )
+    first_page = await handle_service_errors("reservation", fetch_user_reservations_page, auth)
+
+    # A bare array has no room for a partial marker, so every page is fetched before the response starts
+    # and a failed page still turns into a 503.
+    reservations = []
+    async for page in _reservation_pages(first_page, auth):
+        reservations.extend(page)
+    return model_response(List[ReservationResponse], reservations, trusted=True)
 
-    return reservations
+
+async def _accept_booking(body: CreateReservationRequest, auth: str | None, username: str) -> JSONResponse:
+    if body.endDate <= body.startDate:
+        raise HTTPException(status_code=400, detail="Дата выезда должна быть позже даты заезда")
+
+    try:
+        booking = await create_booking({
+            "hotelUid": str(body.hotelUid),
+            "startDate": body.startDate.isoformat(),
+            "endDate": body.endDate.isoformat(),
+        }, auth)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code != 400:
+            raise HTTPException(status_code=503, detail="Reservation Service unavailable")
+        raise HTTPException(status_code=400, detail=f"Отель с UID {body.hotelUid} не найден")
+    except Exception:
+        raise HTTPException(status_code=503, detail="Reservation Service unavailable")
+
+    await publish_task({"type": "booking", "bookingUid": booking["bookingUid"], "username": username})
+
+    status_url = f"/api/v1/bookings/{booking['bookingUid']}"
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        headers={"Location": status_url},
+        content=BookingAcceptedResponse(
+            bookingUid=booking["bookingUid"],
+            status=booking["status"],
+            statusUrl=status_url,
+        ).model_dump(mode="json"),
+    )
 
 
 @router.post("/api/v1/reservations",
              response_model=CreateReservationResponse,
              summary="Забронировать отель")
-def create_reservation(request: Request, body: CreateReservationRequest = Body(...)):
+async def create_reservation(request: Request, body: CreateReservationRequest = Body(...)):
     auth = _auth(request)
     username = _username(request)
 
-    hotel_data = handle_service_errors("reservation", fetch_hotel, body.hotelUid, auth)
+    if BOOKING_MODE == "async" or "respond-async" in request.headers.get("Prefer", ""):
+        return await _accept_booking(body, auth, username)
+
+    hotel_data, loyalty = await asyncio.gather(
+        handle_service_errors("reservation", fetch_hotel, body.hotelUid, auth),
+        _loyalty(auth, username),
+    )
 
     try:
         hotel_data = HotelResponse(**hotel_data)
@@ -119,102 +271,105 @@ def create_reservation(request: Request, body: CreateReservationRequest = Body(.
             status_code=400,
             detail=f"Отель с UID {body.hotelUid} не найден")
 
-    loyalty = handle_service_errors("loyalty", fetch_user_loyalty, auth, fallback=True)
     discount = (loyalty or {}).get("discount", 0)
 
     price = calculate_price(body.startDate, body.endDate, hotel_data.price, discount)
-    payment_data = handle_service_errors("payment", create_payment, price, auth)
+    payment_data = await handle_service_errors("payment", create_payment, price, auth)
 
     try:
-        handle_service_errors("loyalty", update_loyalty, auth, 1)
+        await handle_service_errors("loyalty", update_loyalty, auth, 1)
     except Exception:
-        handle_service_errors("payment", cancel_payment, payment_data["paymentUid"], auth)
+        await _cancel_payment_or_publish(payment_data["paymentUid"], auth, username)
         raise HTTPException(status_code=503, detail="Loyalty Service unavailable")
 
-    reservation_data = handle_service_errors(
-        "reservation",
-        create_reservation_in_service,
-        {
-            "hotelUid": str(body.hotelUid),
-            "paymentUid": str(payment_data["paymentUid"]),
-            "startDate": body.startDate.isoformat(),
-            "endDate": body.endDate.isoformat(),
-            "status": "PAID",
-        },
-        auth
-    )
-
-    return CreateReservationResponse(
-        reservationUid=reservation_data["reservationUid"],
-        hotelUid=body.hotelUid,
-        startDate=body.startDate,
-        endDate=body.endDate,
-        discount=discount,
-        status=reservation_data.get("status", "PAID"),
-        payment=PaymentInfo(
-            status=PaymentStatus(payment_data["status"]),
-            price=payment_data["price"]
+    try:
+        reservation_data = await handle_service_errors(
+            "reservation",
+            create_reservation_in_service,
+            {
+                "hotelUid": str(body.hotelUid),
+                "paymentUid": str(payment_data["paymentUid"]),
+                "startDate": body.startDate.isoformat(),
+                "endDate": body.endDate.isoformat(),
+                "status": "PAID",
+            },
+            auth,
         )
-    )
+    except HTTPException as e:
+        if e.status_code != 409:
+            raise
+        await asyncio.gather(
+            _cancel_payment_or_publish(payment_data["paymentUid"], auth, username),
+            _update_loyalty_or_publish(auth, username, -1),
+        )
+        raise
+
+    return model_response(CreateReservationResponse, {
+        "reservationUid": reservation_data["reservationUid"],
+        "hotelUid": body.hotelUid,
+        "startDate": body.startDate,
+        "endDate": body.endDate,
+        "discount": discount,
+        "status": reservation_data.get("status", "PAID"),
+        "payment": _payment_info(payment_data),
+    })
 
 
 @router.get(
     "/api/v1/reservations/{reservationUid}",
     response_model=ReservationResponse,
     summary="Информация по конкретному бронированию")
-def get_reservation(request: Request, reservationUid: UUID):
+async def get_reservation(request: Request, reservationUid: UUID):
     auth = _auth(request)
-    reservation = handle_service_errors("reservation", fetch_reservation_by_uid, reservationUid, auth)
+    reservation = await handle_service_errors("reservation", fetch_reservation_by_uid, reservationUid, auth)
     if reservation is None:
         raise HTTPException(status_code=404, detail="Бронь не найдена")
 
-    payment_data = handle_service_errors("payment", fetch_payment, reservation["paymentUid"], auth, fallback=True)
-    if payment_data:
-        payment = PaymentInfo(
-            status=PaymentStatus(payment_data["status"]),
-            price=payment_data["price"])
-    else:
-        payment = payment_data
-
-    return ReservationResponse(
-        reservationUid=reservation["reservationUid"],
-        hotel=HotelInfo(**reservation["hotel"]),
-        startDate=reservation["startDate"],
-        endDate=reservation["endDate"],
-        status=reservation["status"],
-        payment=payment
-    )
+    payment_data = await handle_service_errors("payment", fetch_payment, reservation["paymentUid"], auth, fallback=True)
+    return model_response(ReservationResponse, _reservation_payload(reservation, payment_data))
 
 
 @router.delete(
     "/api/v1/reservations/{reservationUid}",
     status_code=status.HTTP_204_NO_CONTENT,
     summary="Отменить бронирование")
-def delete_reservation(request: Request, reservationUid: UUID):
+async def delete_reservation(request: Request, reservationUid: UUID):
     auth = _auth(request)
     username = _username(request)
 
-    reservation = handle_service_errors("reservation", fetch_reservation_by_uid, reservationUid, auth)
+    reservation = await handle_service_errors("reservation", fetch_reservation_by_uid, reservationUid, auth)
     if reservation is None:
         raise HTTPException(status_code=404, detail="Билет не найден")
 
-    handle_service_errors("payment", cancel_payment, reservation["paymentUid"], auth)
+    await handle_service_errors("payment", cancel_payment, reservation["paymentUid"], auth)
+    await asyncio.gather(
+        _update_loyalty_or_publish(auth, username, -1),
+        handle_service_errors("reservation", cancel_reservation, reservationUid, auth),
+    )
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.get("/api/v1/bookings/{bookingUid}",
+            response_model=BookingResponse,
+            response_model_exclude_none=True,
+            summary="Статус асинхронного бронирования")
+async def get_booking(request: Request, bookingUid: UUID):
+    auth = _auth(request)
     try:
-        handle_service_errors("loyalty", update_loyalty, auth, -1)
+        booking = await fetch_booking(bookingUid, auth)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code != 404:
+            raise HTTPException(status_code=503, detail="Reservation Service unavailable")
+        raise HTTPException(status_code=404, detail="Бронирование не найдено")
     except Exception:
-        publish_task({
-            "type": "update_loyalty",
-            "username": username,
-            "delta": -1
-        })
-
-    handle_service_errors("reservation", cancel_reservation, reservationUid, auth)
-    return Response(status_code=status.HTTP_204_NO_CONTENT)
+        raise HTTPException(status_code=503, detail="Reservation Service unavailable")
+    return model_response(BookingResponse, booking, exclude_none=True)
 
 
 @router.get("/api/v1/loyalty",
             summary="Получить информацию о статусе в программе лояльности")
-def get_loyalty_status(request: Request):
+async def get_loyalty_status(request: Request):
     auth = _auth(request)
-    loyalty = handle_service_errors("loyalty", fetch_user_loyalty, auth, fallback=True)
+    username = _username(request)
+    loyalty = await _loyalty(auth, username)
     return loyalty
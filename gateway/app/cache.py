@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+log = logging.getLogger("cache")
+
+
+class AsyncTTLCache:
+    def __init__(self, name: str, max_size: int = 1000, ttl: float = 60.0, stale_ttl: float = 0.0):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+
+        self.entries = OrderedDict()
+        self.in_flight = {}
+        self.refreshing = set()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_size > 0
+
+    def put(self, key, value):
+        now = time.monotonic()
+        self.entries[key] = (value, now + self.ttl, now + self.ttl + self.stale_ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    async def _load(self, key, loader):
+        # The loader runs in its own task, so a waiter that goes away (the first caller included) never
+        # cancels the load the other waiters are sharing.
+        task = self.in_flight.get(key)
+        if task is None:
+            task = self.in_flight[key] = asyncio.ensure_future(self._fill(key, loader))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task)
+
+    async def _fill(self, key, loader):
+        try:
+            value = await loader()
+            if value:
+                self.put(key, value)
+            return value
+        finally:
+            self.in_flight.pop(key, None)
+
+    async def _refresh(self, key, loader):
+        try:
+            await self._load(key, loader)
+        except Exception as e:
+            log.info(f"Cache {self.name}: background refresh of {key} failed: {e}")
+        finally:
+            self.refreshing.discard(key)
+
+    async def get_or_load(self, key, loader):
+        if not self.enabled:
+            return await loader()
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            value, fresh_until, stale_until = entry
+            now = time.monotonic()
+            if now < fresh_until:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            if now < stale_until:
+                self.stale_hits += 1
+                if key not in self.refreshing and key not in self.in_flight:
+                    self.refreshing.add(key)
+                    asyncio.create_task(self._refresh(key, loader))
+                return value
+            del self.entries[key]
+
+        self.misses += 1
+        return await self._load(key, loader)
+
+    def get_stale(self, key):
+        entry = self.entries.get(key)
+        if entry is None or time.monotonic() >= entry[2]:
+            return None
+        return entry[0]
+
+    def invalidate(self, key=None):
+        if key is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "staleHits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
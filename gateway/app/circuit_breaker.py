@@ -1,62 +1,112 @@
+import os
 import time
+import asyncio
+import threading
 from collections import deque
+from .metrics import Counter, Histogram, CallbackMetric
+from .tracing import span
+from .logs import log_call
+from .deadline import check_deadline
+from .retry import retry_budget, retry_delay, client_error, deadline_error
+from .hedge import hedge_budget, hedge_delay, hedges, latency
+
+CIRCUIT_BREAKER_THRESHOLD = int(os.getenv("CIRCUIT_BREAKER_THRESHOLD", "10"))
+CIRCUIT_BREAKER_WINDOW = float(os.getenv("CIRCUIT_BREAKER_WINDOW", "60.0"))
+CIRCUIT_BREAKER_TIMEOUT = float(os.getenv("CIRCUIT_BREAKER_TIMEOUT", "5.0"))
+CIRCUIT_BREAKER_HALF_OPEN_LIMIT = int(os.getenv("CIRCUIT_BREAKER_HALF_OPEN_LIMIT", "3"))
+CIRCUIT_BREAKER_SLOW_CALL = float(os.getenv("CIRCUIT_BREAKER_SLOW_CALL", "3.0"))
+CIRCUIT_BREAKER_PER_ROUTE = os.getenv("CIRCUIT_BREAKER_PER_ROUTE", "0") == "1"
+
+STATES = {"CLOSED": 0, "HALF_OPEN": 1, "OPEN": 2}
+
+breaker_transitions = Counter(
+    "circuit_breaker_transitions_total",
+    "Circuit breaker state transitions",
+    ("breaker", "from_state", "to_state"),
+)
+breaker_rejections = Counter(
+    "circuit_breaker_rejected_total",
+    "Calls rejected by an open circuit breaker",
+    ("breaker",),
+)
+downstream_duration = Histogram(
+    "http_client_request_duration_seconds",
+    "Latency of downstream calls made through the circuit breaker",
+    ("service", "route", "outcome"),
+)
 
 
 class CircuitBreaker:
-    def __init__(self, threshold: int = 10, window: float = 60.0, timeout: float = 5.0, half_open_limit: int = 3):
+    def __init__(self, threshold: int = 10, window: float = 60.0, timeout: float = 5.0, half_open_limit: int = 3,
+                 slow_call_threshold: float = 0.0, name: str = ""):
+        self.name = name
         self.threshold = threshold
         self.window = window
         self.errors = deque()
         self.state = "CLOSED"
         self.timeout = timeout
         self.half_open_limit = half_open_limit
+        self.slow_call_threshold = slow_call_threshold
         self.open_status_time = 0.0
+        self.half_open_time = 0.0
 
         self.half_open_requests = 0
         self.half_open_successes = 0
         self.half_open_failures = 0
 
-    def clear_errors(self):
-        current = time.time()
+        self.lock = threading.Lock()
+
+    def clear_errors(self, current: float):
         while self.errors and (current - self.errors[0] > self.window):
             self.errors.popleft()
 
+    def set_state(self, state: str):
+        if state != self.state:
+            breaker_transitions.inc(self.name, self.state, state)
+        self.state = state
+
     def success_request(self):
-        self.state = "CLOSED"
+        self.set_state("CLOSED")
         self.errors.clear()
 
     def failure_request(self):
-        current = time.time()
+        current = time.monotonic()
         self.errors.append(current)
-        self.clear_errors()
+        self.clear_errors(current)
 
         if len(self.errors) >= self.threshold:
-            self.state = "OPEN"
+            self.set_state("OPEN")
             self.open_status_time = current
 
     def half_open_status(self):
-        self.state = "HALF_OPEN"
+        self.set_state("HALF_OPEN")
+        self.half_open_time = time.monotonic()
         self.half_open_requests = 0
         self.half_open_successes = 0
         self.half_open_failures = 0
 
     def request_available(self) -> bool:
-        if self.state == "CLOSED":
-            return True
-
-        if self.state == "OPEN":
-            if time.time() - self.open_status_time >= self.timeout:
-                self.half_open_status()
+        with self.lock:
+            if self.state == "CLOSED":
                 return True
-            return False
 
-        if self.state == "HALF_OPEN":
-            if self.half_open_requests < self.half_open_limit:
-                self.half_open_requests += 1
-                return True
-            return False
+            if self.state == "OPEN":
+                if time.monotonic() - self.open_status_time >= self.timeout:
+                    self.half_open_status()
+                    self.half_open_requests += 1
+                    return True
+                return False
+
+            if self.state == "HALF_OPEN":
+                # Probes that never reported back (lost slots) must not keep the breaker half-open forever.
+                if time.monotonic() - self.half_open_time >= self.timeout:
+                    self.half_open_status()
+                if self.half_open_requests < self.half_open_limit:
+                    self.half_open_requests += 1
+                    return True
+                return False
 
-        return False
+            return False
 
     def half_open_attempt(self, success: bool):
         if self.state != "HALF_OPEN":
@@ -67,10 +117,29 @@ class CircuitBreaker:
                 self.success_request()
         else:
             self.half_open_failures += 1
-            self.state = "OPEN"
-            self.open_status_time = time.time()
+            self.set_state("OPEN")
+            self.open_status_time = time.monotonic()
             self.errors.append(self.open_status_time)
 
+    def release(self):
+        # Gives back a half-open slot taken by a call that ended without an outcome for the service:
+        # cancelled, or cut short by the caller's own deadline.
+        with self.lock:
+            if self.state == "HALF_OPEN" and self.half_open_requests > 0:
+                self.half_open_requests -= 1
+
+    def record(self, success: bool, duration: float = 0.0):
+        if success and self.slow_call_threshold and duration > self.slow_call_threshold:
+            success = False
+
+        with self.lock:
+            if self.state == "HALF_OPEN":
+                self.half_open_attempt(success)
+            elif success:
+                self.success_request()
+            else:
+                self.failure_request()
+
 
 class CircuitBreakerError(Exception):
     def __init__(self, service: str):
@@ -78,31 +147,146 @@ class CircuitBreakerError(Exception):
         super().__init__(f"Circuit Breaker: {self.service} is open")
 
 
-def request_with_circuit_breaker(service: str, func, *args, **kwargs):
-    breaker = breakers[service]
+breakers_lock = threading.Lock()
+
+
+def new_breaker(name: str) -> CircuitBreaker:
+    return CircuitBreaker(
+        name=name,
+        threshold=CIRCUIT_BREAKER_THRESHOLD,
+        window=CIRCUIT_BREAKER_WINDOW,
+        timeout=CIRCUIT_BREAKER_TIMEOUT,
+        half_open_limit=CIRCUIT_BREAKER_HALF_OPEN_LIMIT,
+        slow_call_threshold=CIRCUIT_BREAKER_SLOW_CALL,
+    )
 
+
+def get_breaker(service: str, route: str | None = None) -> tuple[str, CircuitBreaker]:
+    key = f"{service} {route}" if CIRCUIT_BREAKER_PER_ROUTE and route else service
+    breaker = breakers.get(key)
+    if breaker is None:
+        with breakers_lock:
+            breaker = breakers.setdefault(key, new_breaker(key))
+    return key, breaker
+
+
+async def _attempt(key: str, breaker: CircuitBreaker, service: str, route: str | None, func, args, kwargs):
     if not breaker.request_available():
-        raise CircuitBreakerError(service)
+        breaker_rejections.inc(key)
+        raise CircuitBreakerError(key)
 
+    start = time.monotonic()
     try:
-        result = func(*args, **kwargs)
+        with span(service, route=route):
+            result = await func(*args, **kwargs)
+    except asyncio.CancelledError:
+        breaker.release()
+        downstream_duration.observe(time.monotonic() - start, service, route, "cancelled")
+        raise
     except Exception as e:
-        if breaker.state == "HALF_OPEN":
-            breaker.half_open_attempt(False)
+        elapsed = time.monotonic() - start
+        if deadline_error(e):
+            breaker.release()
+        elif client_error(e):
+            breaker.record(True, elapsed)
         else:
-            breaker.failure_request()
+            breaker.record(False)
+        downstream_duration.observe(elapsed, service, route, "error")
+        log_call(service, route, elapsed, e)
         raise e
 
-    if breaker.state == "HALF_OPEN":
-        breaker.half_open_attempt(True)
-    else:
-        breaker.success_request()
-
+    elapsed = time.monotonic() - start
+    breaker.record(True, elapsed)
+    downstream_duration.observe(elapsed, service, route, "ok")
+    log_call(service, route, elapsed)
     return result
 
 
+# Primaries still running after their hedge won; the event loop only keeps weak references to tasks.
+_outliving_primaries = set()
+
+
+async def _hedged_attempt(key: str, breaker: CircuitBreaker, service: str, route: str | None, func, args, kwargs):
+    delay = hedge_delay(route)
+    if delay is None:
+        return await _attempt(key, breaker, service, route, func, args, kwargs)
+
+    hedge_budget.deposit()
+    start = time.monotonic()
+    primary = asyncio.ensure_future(_attempt(key, breaker, service, route, func, args, kwargs))
+
+    def observe_primary(task: asyncio.Future):
+        # Every primary is sampled, hedged or not. Sampling the winner instead would drop exactly the slow
+        # tail a hedge cuts short and pull the delay estimate down.
+        if not task.cancelled() and task.exception() is None:
+            latency.observe(route, time.monotonic() - start)
+
+    primary.add_done_callback(observe_primary)
+    tasks = {primary}
+    hedge_won = False
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            if breaker.state == "CLOSED" and hedge_budget.withdraw():
+                hedges.inc(service, "sent")
+                tasks.add(asyncio.ensure_future(_attempt(key, breaker, service, route, func, args, kwargs)))
+            else:
+                hedges.inc(service, "skipped")
+
+        errors = []
+        pending = tasks
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        hedges.inc(service, "won")
+                        hedge_won = True
+                    return task.result()
+                errors.append(task.exception())
+        raise errors[0]
+    finally:
+        # A primary beaten by its hedge is left to finish so its latency is still observed; the client timeout
+        # bounds it.
+        for task in tasks:
+            if task.done():
+                continue
+            if hedge_won and task is primary:
+                _outliving_primaries.add(task)
+                task.add_done_callback(_outliving_primaries.discard)
+            else:
+                task.cancel()
+
+
+async def request_with_circuit_breaker(service: str, func, *args, route: str | None = None, hedge: bool = False,
+                                      **kwargs):
+    key, breaker = get_breaker(service, route)
+    retry_budget.deposit()
+    attempt_func = _hedged_attempt if hedge else _attempt
+
+    attempt = 0
+    while True:
+        check_deadline()
+        try:
+            return await attempt_func(key, breaker, service, route, func, args, kwargs)
+        except Exception as e:
+            delay = retry_delay(service, route, attempt, e)
+            if delay is None:
+                raise
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
 breakers = {
-    "reservation": CircuitBreaker(),
-    "payment": CircuitBreaker(),
-    "loyalty": CircuitBreaker(),
-}
\ No newline at end of file
+    "reservation": new_breaker("reservation"),
+    "payment": new_breaker("payment"),
+    "loyalty": new_breaker("loyalty"),
+}
+
+CallbackMetric(
+    "circuit_breaker_state",
+    "Circuit breaker state (0 closed, 1 half-open, 2 open)",
+    "gauge",
+    ("breaker",),
+    lambda: [((key,), STATES[b.state]) for key, b in list(breakers.items())],
+)
@@ -1,11 +1,12 @@
+import asyncio
 import httpx
+from pydantic_core import from_json
 import os
-import logging
 from uuid import UUID
 from .circuit_breaker import request_with_circuit_breaker
-
-logging.basicConfig(level=logging.INFO)
-log = logging.getLogger("gateway")
+from .cache import AsyncTTLCache
+from .tracing import trace_headers
+from .deadline import deadline_headers, timeout_for
 
 services = {
     "LOYALTY_URL": os.getenv("LOYALTY_URL", "http://loyalty-microservice:8050"),
@@ -13,149 +14,345 @@ services = {
     "RESERVATION_URL": os.getenv("RESERVATION_URL", "http://reservation-microservice:8070"),
 }
 
-client = httpx.Client(timeout=5.0)
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "5.0"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "200"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "50"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30.0"))
+
+client: httpx.AsyncClient | None = None
+
+PAYMENTS_BATCH_SIZE = 100
+LOYALTY_SERVICE_TOKEN = os.getenv("LOYALTY_SERVICE_TOKEN")
+SERVICE_TOKEN = os.getenv("SERVICE_TOKEN")
+RESERVATIONS_PAGE_SIZE = int(os.getenv("RESERVATIONS_PAGE_SIZE", "50"))
+
+HOTEL_CACHE_SIZE = int(os.getenv("HOTEL_CACHE_SIZE", "10000"))
+HOTEL_CACHE_TTL = float(os.getenv("HOTEL_CACHE_TTL", "60.0"))
+HOTEL_CACHE_STALE_TTL = float(os.getenv("HOTEL_CACHE_STALE_TTL", "300.0"))
+HOTELS_PAGE_CACHE_SIZE = int(os.getenv("HOTELS_PAGE_CACHE_SIZE", "1000"))
+HOTELS_PAGE_CACHE_TTL = float(os.getenv("HOTELS_PAGE_CACHE_TTL", "30.0"))
+
+LOYALTY_LAST_KNOWN_SIZE = int(os.getenv("LOYALTY_LAST_KNOWN_SIZE", "10000"))
+LOYALTY_LAST_KNOWN_TTL = float(os.getenv("LOYALTY_LAST_KNOWN_TTL", "3600.0"))
+
+hotel_cache = AsyncTTLCache("hotel", max_size=HOTEL_CACHE_SIZE, ttl=HOTEL_CACHE_TTL, stale_ttl=HOTEL_CACHE_STALE_TTL)
+hotels_page_cache = AsyncTTLCache("hotels_page", max_size=HOTELS_PAGE_CACHE_SIZE, ttl=HOTELS_PAGE_CACHE_TTL,
+                                  stale_ttl=HOTEL_CACHE_STALE_TTL)
+loyalty_last_known = AsyncTTLCache("loyalty_last_known", max_size=LOYALTY_LAST_KNOWN_SIZE, ttl=0.0,
+                                   stale_ttl=LOYALTY_LAST_KNOWN_TTL)
+
+
+async def _prepare_request(request: httpx.Request):
+    request.headers.update(trace_headers())
+    request.headers.update(deadline_headers())
+    timeout = timeout_for(HTTP_TIMEOUT)
+    request.extensions["timeout"] = httpx.Timeout(timeout).as_dict()
+    request.extensions["deadline_bound"] = timeout < HTTP_TIMEOUT
+
+
+async def start_client() -> httpx.AsyncClient:
+    global client
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            event_hooks={"request": [_prepare_request]},
+        )
+    return client
+
+
+async def close_client():
+    global client
+    if client is not None:
+        await client.aclose()
+        client = None
+
+
+def _client() -> httpx.AsyncClient:
+    if client is None:
+        raise RuntimeError("HTTP client is not started")
+    return client
+
+
+class ServiceAuth:
+    # The gateway's own credential, optionally acting for one user. Used wherever no live user token exists:
+    # queued tasks replayed by the worker and cache refreshes shared between users.
+    __slots__ = ("username",)
+
+    def __init__(self, username: str | None = None):
+        self.username = username
+
+
+def _auth_headers(auth: str | ServiceAuth | None) -> dict:
+    if isinstance(auth, ServiceAuth):
+        headers = {"X-Service-Token": SERVICE_TOKEN or ""}
+        if auth.username:
+            headers["X-On-Behalf-Of"] = auth.username
+        return headers
+    return {"Authorization": auth} if auth else {}
 
 
-def _auth_headers(auth: str | None) -> dict:
-    return {"Authorization": auth} if auth else {}
+def _shared_auth(auth: str | None) -> str | ServiceAuth | None:
+    # Cached hotel data is the same for every user, and the loader outlives the request that created it:
+    # stale refreshes and joined in-flight loads run for other callers, possibly after this token expired.
+    # The caller was already authenticated by the gateway, so the load itself uses the service credential.
+    return ServiceAuth() if SERVICE_TOKEN else auth
 
 
-def _fetch_hotels_raw(page: int, size: int, auth: str | None) -> dict:
+async def _fetch_hotels_raw(page: int, size: int, auth: str | None, cursor: str | None = None) -> dict:
     url = f"{services['RESERVATION_URL']}/api/v1/hotels"
-    log.info(f"GET {url} params={{'page': {page}, 'size': {size}}} headers={{'Authorization': {'set' if auth else 'none'}}}")
-    r = client.get(url, params={"page": page, "size": size}, headers=_auth_headers(auth))
-    log.info(f"Response {r.status_code} {url}")
+    params = {"page": page, "size": size}
+    if cursor is not None:
+        params["cursor"] = cursor
+    r = await _client().get(url, params=params, headers=_auth_headers(auth))
+    r.raise_for_status()
+    return from_json(r.content)
+
+
+async def fetch_hotels(page: int, size: int, auth: str | None, cursor: str | None = None) -> dict:
+    auth = _shared_auth(auth)
+    return await hotels_page_cache.get_or_load(
+        (page, size, cursor),
+        lambda: request_with_circuit_breaker("reservation", _fetch_hotels_raw, page, size, auth, cursor, route="GET /api/v1/hotels"))
+
+
+async def _search_hotels_raw(params: dict, auth: str | None) -> dict:
+    url = f"{services['RESERVATION_URL']}/api/v1/hotels/search"
+    r = await _client().get(url, params=params, headers=_auth_headers(auth))
+    r.raise_for_status()
+    return from_json(r.content)
+
+
+async def search_hotels(params: dict, auth: str | None) -> dict:
+    params = {k: v for k, v in params.items() if v is not None}
+    auth = _shared_auth(auth)
+    return await hotels_page_cache.get_or_load(
+        ("search", *sorted(params.items())),
+        lambda: request_with_circuit_breaker("reservation", _search_hotels_raw, params, auth, route="GET /api/v1/hotels/search", hedge=True))
+
+
+async def _fetch_availability_raw(hotel_uid: UUID, start_date: str, end_date: str, auth: str | None) -> dict:
+    url = f"{services['RESERVATION_URL']}/api/v1/hotels/{hotel_uid}/availability"
+    r = await _client().get(url, params={"startDate": start_date, "endDate": end_date}, headers=_auth_headers(auth))
     r.raise_for_status()
-    return r.json()
+    return from_json(r.content)
 
 
-def fetch_hotels(page: int, size: int, auth: str | None) -> dict:
-    return request_with_circuit_breaker("reservation", _fetch_hotels_raw, page, size, auth)
+async def fetch_availability(hotel_uid: UUID, start_date: str, end_date: str, auth: str | None) -> dict:
+    return await request_with_circuit_breaker("reservation", _fetch_availability_raw, hotel_uid, start_date, end_date, auth, route="GET /api/v1/hotels/{hotelUid}/availability")
 
 
-def _fetch_user_reservations_raw(auth: str | None) -> dict:
-    url = f"{services['RESERVATION_URL']}/api/v1/me"
-    log.info(f"GET {url} headers={{'Authorization': {'set' if auth else 'none'}}}")
-    r = client.get(url, headers=_auth_headers(auth))
-    log.info(f"Response {r.status_code} {url}")
+async def _fetch_user_reservations_page_raw(auth: str | None, cursor: str | None, size: int) -> dict:
+    url = f"{services['RESERVATION_URL']}/api/v1/reservations"
+    params = {"size": size}
+    if cursor is not None:
+        params["cursor"] = cursor
+    r = await _client().get(url, params=params, headers=_auth_headers(auth))
     r.raise_for_status()
-    return r.json()
+    return from_json(r.content)
 
 
-def fetch_user_reservations(auth: str | None) -> dict:
-    return request_with_circuit_breaker("reservation", _fetch_user_reservations_raw, auth)
+async def fetch_user_reservations_page(auth: str | None, cursor: str | None = None,
+                                       size: int = RESERVATIONS_PAGE_SIZE) -> dict:
+    return await request_with_circuit_breaker("reservation", _fetch_user_reservations_page_raw, auth, cursor, size, route="GET /api/v1/reservations")
 
 
-def _fetch_reservation_by_uid_raw(reservation_uid: UUID, auth: str | None) -> dict:
+async def _fetch_reservation_by_uid_raw(reservation_uid: UUID, auth: str | None) -> dict:
     url = f"{services['RESERVATION_URL']}/api/v1/reservations/{reservation_uid}"
-    log.info(f"GET {url} headers={{'Authorization': {'set' if auth else 'none'}}}")
-    r = client.get(url, headers=_auth_headers(auth))
-    log.info(f"Response {r.status_code} {url}")
+    r = await _client().get(url, headers=_auth_headers(auth))
     r.raise_for_status()
-    return r.json()
+    return from_json(r.content)
 
 
-def fetch_reservation_by_uid(reservation_uid: UUID, auth: str | None) -> dict:
-    return request_with_circuit_breaker("reservation", _fetch_reservation_by_uid_raw, reservation_uid, auth)
+async def fetch_reservation_by_uid(reservation_uid: UUID, auth: str | None) -> dict:
+    return await request_with_circuit_breaker("reservation", _fetch_reservation_by_uid_raw, reservation_uid, auth, route="GET /api/v1/reservations/{reservationUid}")
 
 
-def _fetch_hotel_raw(hotel_uid: UUID, auth: str | None) -> dict:
+async def _fetch_hotel_raw(hotel_uid: UUID, auth: str | None) -> dict:
     url = f"{services['RESERVATION_URL']}/api/v1/hotel/{hotel_uid}"
-    log.info(f"GET {url} headers={{'Authorization': {'set' if auth else 'none'}}}")
-    r = client.get(url, headers=_auth_headers(auth))
-    log.info(f"Response {r.status_code} {url}")
+    r = await _client().get(url, headers=_auth_headers(auth))
     r.raise_for_status()
-    return r.json()
+    return from_json(r.content)
+
 
+async def fetch_hotel(hotel_uid: UUID, auth: str | None) -> dict:
+    auth = _shared_auth(auth)
+    return await hotel_cache.get_or_load(
+        str(hotel_uid),
+        lambda: request_with_circuit_breaker("reservation", _fetch_hotel_raw, hotel_uid, auth, route="GET /api/v1/hotel/{hotelUid}", hedge=True))
 
-def fetch_hotel(hotel_uid: UUID, auth: str | None) -> dict:
-    return request_with_circuit_breaker("reservation", _fetch_hotel_raw, hotel_uid, auth)
 
+def invalidate_hotels(hotel_uid: UUID | None = None):
+    if hotel_uid is None:
+        hotel_cache.invalidate()
+    else:
+        hotel_cache.invalidate(str(hotel_uid))
+    hotels_page_cache.invalidate()
 
-def _create_reservation_in_service_raw(res_data: dict, auth: str | None) -> dict:
+
+async def _create_reservation_in_service_raw(res_data: dict, auth: str | None) -> dict:
     url = f"{services['RESERVATION_URL']}/api/v1/reservations"
-    log.info(f"POST {url} headers={{'Authorization': {'set' if auth else 'none'}}} json={res_data}")
-    r = client.post(url, headers=_auth_headers(auth), json=res_data)
-    log.info(f"Response {r.status_code} {url}")
+    r = await _client().post(url, headers=_auth_headers(auth), json=res_data)
     r.raise_for_status()
-    return r.json()
+    return from_json(r.content)
 
 
-def create_reservation_in_service(res_data: dict, auth: str | None) -> dict:
-    return request_with_circuit_breaker("reservation", _create_reservation_in_service_raw, res_data, auth)
+async def create_reservation_in_service(res_data: dict, auth: str | None) -> dict:
+    return await request_with_circuit_breaker("reservation", _create_reservation_in_service_raw, res_data, auth, route="POST /api/v1/reservations")
 
 
-def _create_payment_raw(price: int, auth: str | None) -> dict:
+async def _create_payment_raw(price: int, auth: str | None, payment_uid: UUID | None = None) -> dict:
     url = f"{services['PAYMENT_URL']}/api/v1/payments"
-    log.info(f"POST {url} headers={{'Authorization': {'set' if auth else 'none'}}} json={{'price': {price}}}")
-    r = client.post(url, headers=_auth_headers(auth), json={"price": price})
-    log.info(f"Response {r.status_code} {url}")
+    body = {"price": price}
+    if payment_uid is not None:
+        body["paymentUid"] = str(payment_uid)
+    r = await _client().post(url, headers=_auth_headers(auth), json=body)
     r.raise_for_status()
-    return r.json()
+    return from_json(r.content)
 
 
-def create_payment(price: int, auth: str | None) -> dict:
-    return request_with_circuit_breaker("payment", _create_payment_raw, price, auth)
+async def create_payment(price: int, auth: str | None, payment_uid: UUID | None = None) -> dict:
+    return await request_with_circuit_breaker("payment", _create_payment_raw, price, auth, payment_uid, route="POST /api/v1/payments")
 
 
-def _fetch_payment_raw(payment_uid: UUID, auth: str | None) -> dict:
+async def _fetch_payment_raw(payment_uid: UUID, auth: str | None) -> dict:
     url = f"{services['PAYMENT_URL']}/api/v1/payments/{payment_uid}"
-    log.info(f"GET {url} headers={{'Authorization': {'set' if auth else 'none'}}}")
-    r = client.get(url, headers=_auth_headers(auth))
-    log.info(f"Response {r.status_code} {url}")
+    r = await _client().get(url, headers=_auth_headers(auth))
     r.raise_for_status()
-    return r.json()
+    return from_json(r.content)
+
 
+async def fetch_payment(payment_uid: UUID, auth: str | None) -> dict:
+    return await request_with_circuit_breaker("payment", _fetch_payment_raw, payment_uid, auth, route="GET /api/v1/payments/{paymentUid}", hedge=True)
+
+
+async def _fetch_payments_bulk_raw(payment_uids: list[UUID], auth: str | None) -> dict:
+    url = f"{services['PAYMENT_URL']}/api/v1/payments:batchGet"
+    r = await _client().post(url, headers=_auth_headers(auth), json={"paymentUids": [str(uid) for uid in payment_uids]})
+    r.raise_for_status()
+    return {str(item["paymentUid"]): item for item in from_json(r.content).get("items", [])}
 
-def fetch_payment(payment_uid: UUID, auth: str | None) -> dict:
-    return request_with_circuit_breaker("payment", _fetch_payment_raw, payment_uid, auth)
 
+async def fetch_payments_bulk(payment_uids: list[UUID], auth: str | None) -> dict:
+    chunks = [payment_uids[i:i + PAYMENTS_BATCH_SIZE] for i in range(0, len(payment_uids), PAYMENTS_BATCH_SIZE)]
+    results = await asyncio.gather(
+        *(request_with_circuit_breaker("payment", _fetch_payments_bulk_raw, chunk, auth, route="POST /api/v1/payments:batchGet") for chunk in chunks))
 
-def _fetch_user_loyalty_raw(auth: str | None) -> dict:
+    payments = {}
+    for result in results:
+        payments.update(result)
+    return payments
+
+
+async def _fetch_user_loyalty_raw(auth: str | None) -> dict:
     url = f"{services['LOYALTY_URL']}/api/v1/me"
-    log.info(f"GET {url} headers={{'Authorization': {'set' if auth else 'none'}}}")
-    r = client.get(url, headers=_auth_headers(auth))
-    log.info(f"Response {r.status_code} {url}")
+    r = await _client().get(url, headers=_auth_headers(auth))
     r.raise_for_status()
-    return r.json()
+    return from_json(r.content)
 
 
-def fetch_user_loyalty(auth: str | None) -> dict:
-    return request_with_circuit_breaker("loyalty", _fetch_user_loyalty_raw, auth)
+async def fetch_user_loyalty(auth: str | None) -> dict:
+    return await request_with_circuit_breaker("loyalty", _fetch_user_loyalty_raw, auth, route="GET /api/v1/me", hedge=True)
 
 
-def _update_loyalty_raw(auth: str | None, delta: int) -> dict:
+async def _update_loyalty_raw(auth: str | None, delta: int, idempotency_key: str | None = None) -> dict:
     url = f"{services['LOYALTY_URL']}/api/v1/loyalty"
-    log.info(f"PATCH {url} headers={{'Authorization': {'set' if auth else 'none'}}} json={{'delta': {delta}}}")
-    r = client.patch(url, headers=_auth_headers(auth), json={"delta": delta})
-    log.info(f"Response {r.status_code} {url}")
+    headers = _auth_headers(auth)
+    if idempotency_key is not None:
+        headers["Idempotency-Key"] = idempotency_key
+    r = await _client().patch(url, headers=headers, json={"delta": delta})
+    r.raise_for_status()
+    return from_json(r.content)
+
+
+async def update_loyalty(auth: str | None, delta: int, idempotency_key: str | None = None) -> dict:
+    return await request_with_circuit_breaker("loyalty", _update_loyalty_raw, auth, delta, idempotency_key, route="PATCH /api/v1/loyalty")
+
+
+async def _revert_loyalty_raw(operation_key: str, auth: str | None) -> None:
+    url = f"{services['LOYALTY_URL']}/api/v1/loyalty/operations/{operation_key}/revert"
+    r = await _client().patch(url, headers=_auth_headers(auth))
     r.raise_for_status()
-    return r.json()
 
 
-def update_loyalty(auth: str | None, delta: int) -> dict:
-    return request_with_circuit_breaker("loyalty", _update_loyalty_raw, auth, delta)
+async def revert_loyalty(operation_key: str, auth: str | None) -> None:
+    return await request_with_circuit_breaker("loyalty", _revert_loyalty_raw, operation_key, auth, route="PATCH /api/v1/loyalty/operations/{operationKey}/revert")
+
+
+async def _update_loyalty_bulk_raw(items: list[dict]) -> dict:
+    url = f"{services['LOYALTY_URL']}/api/v1/loyalty:batchUpdate"
+    r = await _client().post(url, headers={"X-Service-Token": LOYALTY_SERVICE_TOKEN}, json={"items": items})
+    r.raise_for_status()
+    return from_json(r.content)
 
 
-def _cancel_payment_raw(payment_uid: UUID, auth: str | None) -> None:
+async def update_loyalty_bulk(items: list[dict]) -> dict:
+    return await request_with_circuit_breaker("loyalty", _update_loyalty_bulk_raw, items, route="POST /api/v1/loyalty:batchUpdate")
+
+
+async def _cancel_payment_raw(payment_uid: UUID, auth: str | None) -> None:
     url = f"{services['PAYMENT_URL']}/api/v1/payments/{payment_uid}/cancel"
-    log.info(f"PATCH {url} headers={{'Authorization': {'set' if auth else 'none'}}}")
-    r = client.patch(url, headers=_auth_headers(auth))
-    log.info(f"Response {r.status_code} {url}")
+    r = await _client().patch(url, headers=_auth_headers(auth))
     r.raise_for_status()
 
 
-def cancel_payment(payment_uid: UUID, auth: str | None) -> None:
-    return request_with_circuit_breaker("payment", _cancel_payment_raw, payment_uid, auth)
+async def cancel_payment(payment_uid: UUID, auth: str | None) -> None:
+    return await request_with_circuit_breaker("payment", _cancel_payment_raw, payment_uid, auth, route="PATCH /api/v1/payments/{paymentUid}/cancel")
 
 
-def _cancel_reservation_raw(reservation_uid: UUID, auth: str | None) -> None:
+async def _cancel_reservation_raw(reservation_uid: UUID, auth: str | None) -> None:
     url = f"{services['RESERVATION_URL']}/api/v1/reservations/{reservation_uid}/cancel"
-    log.info(f"PATCH {url} headers={{'Authorization': {'set' if auth else 'none'}}}")
-    r = client.patch(url, headers=_auth_headers(auth))
-    log.info(f"Response {r.status_code} {url}")
+    r = await _client().patch(url, headers=_auth_headers(auth))
+    r.raise_for_status()
+
+
+async def cancel_reservation(reservation_uid: UUID, auth: str | None) -> None:
+    return await request_with_circuit_breaker("reservation", _cancel_reservation_raw, reservation_uid, auth, route="PATCH /api/v1/reservations/{reservationUid}/cancel")
+
+
+async def _create_booking_raw(booking_data: dict, auth: str | None) -> dict:
+    url = f"{services['RESERVATION_URL']}/api/v1/bookings"
+    r = await _client().post(url, headers=_auth_headers(auth), json=booking_data)
+    r.raise_for_status()
+    return from_json(r.content)
+
+
+async def create_booking(booking_data: dict, auth: str | None) -> dict:
+    return await request_with_circuit_breaker("reservation", _create_booking_raw, booking_data, auth, route="POST /api/v1/bookings")
+
+
+async def _fetch_booking_raw(booking_uid: UUID, auth: str | None) -> dict:
+    url = f"{services['RESERVATION_URL']}/api/v1/bookings/{booking_uid}"
+    r = await _client().get(url, headers=_auth_headers(auth))
+    r.raise_for_status()
+    return from_json(r.content)
+
+
+async def fetch_booking(booking_uid: UUID, auth: str | None) -> dict:
+    return await request_with_circuit_breaker("reservation", _fetch_booking_raw, booking_uid, auth, route="GET /api/v1/bookings/{bookingUid}")
+
+
+async def _update_booking_raw(booking_uid: UUID, changes: dict, auth: str | None) -> dict:
+    url = f"{services['RESERVATION_URL']}/api/v1/bookings/{booking_uid}"
+    r = await _client().patch(url, headers=_auth_headers(auth), json=changes)
+    r.raise_for_status()
+    return from_json(r.content)
+
+
+async def update_booking(booking_uid: UUID, changes: dict, auth: str | None) -> dict:
+    return await request_with_circuit_breaker("reservation", _update_booking_raw, booking_uid, changes, auth, route="PATCH /api/v1/bookings/{bookingUid}")
+
+
+async def _complete_booking_raw(booking_uid: UUID, auth: str | None) -> dict:
+    url = f"{services['RESERVATION_URL']}/api/v1/bookings/{booking_uid}/complete"
+    r = await _client().post(url, headers=_auth_headers(auth))
     r.raise_for_status()
+    return from_json(r.content)
 
 
-def cancel_reservation(reservation_uid: UUID, auth: str | None) -> None:
-    return request_with_circuit_breaker("reservation", _cancel_reservation_raw, reservation_uid, auth)
+async def complete_booking(booking_uid: UUID, auth: str | None) -> dict:
+    return await request_with_circuit_breaker("reservation", _complete_booking_raw, booking_uid, auth, route="POST /api/v1/bookings/{bookingUid}/complete")
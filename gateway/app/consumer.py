@@ -1,19 +1,356 @@
-from pika import BlockingConnection, ConnectionParameters, PlainCredentials
-from .clients import update_loyalty
+from pika import BasicProperties, BlockingConnection, ConnectionParameters, PlainCredentials
+from pika.exceptions import AMQPError, NackError, UnroutableError
+from .clients import (start_client, update_loyalty, update_loyalty_bulk, cancel_payment, ServiceAuth,
+                      LOYALTY_SERVICE_TOKEN, SERVICE_TOKEN)
+from .saga import run_booking, SagaFailed
+from .metrics import CallbackMetric, start_metrics_server
+from .logs import setup_logging
+import httpx
+import asyncio
 import logging
 import json
 import os
+import threading
 import time
 
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
 RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT"))
 RABBITMQ_USER = os.getenv("RABBITMQ_USER")
 RABBITMQ_PASSWORD = os.getenv("RABBITMQ_PASSWORD")
 
+CONSUMER_PREFETCH = int(os.getenv("CONSUMER_PREFETCH", "128"))
+CONSUMER_CONCURRENCY = int(os.getenv("CONSUMER_CONCURRENCY", "16"))
+CONSUMER_MAX_ATTEMPTS = int(os.getenv("CONSUMER_MAX_ATTEMPTS", "6"))
+CONSUMER_RETRY_BASE = float(os.getenv("CONSUMER_RETRY_BASE", "5.0"))
+CONSUMER_STATS_INTERVAL = float(os.getenv("CONSUMER_STATS_INTERVAL", "30.0"))
+CONSUMER_RECONNECT_DELAY = float(os.getenv("CONSUMER_RECONNECT_DELAY", "5.0"))
+CONSUMER_METRICS_PORT = int(os.getenv("CONSUMER_METRICS_PORT", "9100"))
+CONSUMER_LOYALTY_BATCH_SIZE = int(os.getenv("CONSUMER_LOYALTY_BATCH_SIZE", "100"))
+CONSUMER_LOYALTY_BATCH_WAIT = float(os.getenv("CONSUMER_LOYALTY_BATCH_WAIT", "0.2"))
+
+QUEUE_NAME = "messages"
+DLQ_NAME = f"{QUEUE_NAME}.dlq"
+
 credentials = PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
 
+log = logging.getLogger("consumer")
+
+
+class PermanentError(Exception):
+    pass
+
+
+def retry_delay(attempt: int) -> float:
+    return CONSUMER_RETRY_BASE * 2 ** (attempt - 1)
+
+
+def retry_ttl(attempt: int) -> int:
+    return int(retry_delay(attempt) * 1000)
+
+
+def retry_queue(attempt: int) -> str:
+    # The TTL is part of the name: queue arguments cannot change once declared, so a new CONSUMER_RETRY_BASE
+    # declares new queues instead of failing with PRECONDITION_FAILED on the old ones.
+    return f"{QUEUE_NAME}.retry.{attempt}.{retry_ttl(attempt)}ms"
+
+
+class ConsumerStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.received = 0
+        self.processed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.in_flight = 0
+        self.handle_time = 0.0
+        self.lag_max = 0.0
+        self.batches = 0
+        self.batched = 0
+        self.started = time.monotonic()
+
+    def receive(self, lag: float | None):
+        with self.lock:
+            self.received += 1
+            self.in_flight += 1
+            if lag is not None:
+                self.lag_max = max(self.lag_max, lag)
+
+    def finish(self, outcome: str, duration: float):
+        with self.lock:
+            self.in_flight -= 1
+            self.handle_time += duration
+            if outcome == "ack":
+                self.processed += 1
+            elif outcome == "retry":
+                self.retried += 1
+            elif outcome == "dead":
+                self.dead_lettered += 1
+
+    def batch(self, size: int):
+        with self.lock:
+            self.batches += 1
+            self.batched += size
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            done = self.processed + self.retried + self.dead_lettered
+            return {
+                "received": self.received,
+                "processed": self.processed,
+                "retried": self.retried,
+                "deadLettered": self.dead_lettered,
+                "inFlight": self.in_flight,
+                "throughput": round(done / elapsed, 3) if elapsed else 0.0,
+                "avgHandleTime": round(self.handle_time / done, 6) if done else 0.0,
+                "lagMax": round(self.lag_max, 3),
+                "loyaltyBatches": self.batches,
+                "loyaltyBatchedMessages": self.batched,
+            }
+
+
+stats = ConsumerStats()
+
+CallbackMetric(
+    "rabbitmq_consumer_messages",
+    "RabbitMQ consumer counters and gauges (received, processed, retried, deadLettered, inFlight, ...)",
+    "gauge",
+    ("kind",),
+    lambda: [((k,), v) for k, v in stats.snapshot().items()],
+)
+
+
+class LoyaltyBatcher:
+    def __init__(self, max_size: int = 100, max_wait: float = 0.2):
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.pending = []
+        self.timer = None
+
+    async def submit(self, username: str, delta: int, key: str | None = None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((username, delta, key, future))
+        if len(self.pending) >= self.max_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_wait, self.flush)
+        await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self.apply(batch))
+
+    async def apply(self, batch: list):
+        # Keyed deltas are sent one by one so the loyalty service can drop redeliveries; unkeyed ones are summed.
+        items, deltas = [], {}
+        for username, delta, key, _ in batch:
+            if key is not None:
+                items.append({"username": username, "delta": delta, "key": key})
+            else:
+                deltas[username] = deltas.get(username, 0) + delta
+        items.extend({"username": username, "delta": delta} for username, delta in deltas.items() if delta)
+
+        try:
+            result = await update_loyalty_bulk(items) if items else {}
+        except Exception as e:
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        stats.batch(len(batch))
+        missing = set(result.get("missing", []))
+        for username, _, _, future in batch:
+            if future.done():
+                continue
+            if username in missing:
+                future.set_exception(PermanentError(f"Unknown loyalty user {username}"))
+            else:
+                future.set_result(None)
+
+
+loyalty_batcher = LoyaltyBatcher(CONSUMER_LOYALTY_BATCH_SIZE, CONSUMER_LOYALTY_BATCH_WAIT)
+
+
+def batched(task: dict) -> bool:
+    return bool(LOYALTY_SERVICE_TOKEN) and task.get("type") == "update_loyalty" and bool(task.get("username"))
+
+
+def task_auth(task: dict) -> str | ServiceAuth:
+    # Tasks carry the username, not the user's token; messages queued by older gateways may still hold "auth".
+    if task.get("auth"):
+        return task["auth"]
+    if not task.get("username"):
+        raise PermanentError(f"{task.get('type')} task without username")
+    return ServiceAuth(task["username"])
+
+
+def task_key(task: dict) -> str | None:
+    return f"task:{task['id']}" if task.get("id") else None
+
+
+async def handle_task(task: dict, final_attempt: bool = False):
+    task_type = task.get("type")
+    try:
+        if batched(task):
+            await loyalty_batcher.submit(task["username"], int(task.get("delta", 0)), task_key(task))
+            return
+
+        if task_type == "update_loyalty":
+            await update_loyalty(task_auth(task), task.get("delta"), task_key(task))
+            return
+
+        if task_type == "cancel_payment":
+            if not task.get("paymentUid"):
+                raise PermanentError("cancel_payment task without paymentUid")
+            await cancel_payment(task["paymentUid"], task_auth(task))
+            return
+
+        if task_type == "booking":
+            await run_booking(task, final_attempt)
+            return
+    except SagaFailed as e:
+        raise PermanentError(str(e))
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code in (400, 401, 403, 404, 422):
+            raise PermanentError(str(e))
+        raise
+
+    raise PermanentError(f"Unknown task type {task_type}")
+
+
+def outcome(future) -> BaseException | None:
+    # A cancelled task has no exception to report; treat it as a transient failure so the message is retried.
+    if future.cancelled():
+        return asyncio.CancelledError()
+    return future.exception()
+
+
+class Worker:
+    def __init__(self, params: ConnectionParameters):
+        self.params = params
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, name="consumer-loop", daemon=True)
+        self.semaphore = asyncio.Semaphore(CONSUMER_CONCURRENCY)
+        self.conn = None
+        self.channel = None
+
+    def start_loop(self):
+        self.loop_thread.start()
+        asyncio.run_coroutine_threadsafe(start_client(), self.loop).result()
+
+    async def _run(self, task: dict, final_attempt: bool):
+        if batched(task):
+            await handle_task(task, final_attempt)
+            return
+        async with self.semaphore:
+            await handle_task(task, final_attempt)
+
+    def declare(self, ch):
+        ch.queue_declare(queue=QUEUE_NAME, durable=True)
+        ch.queue_declare(queue=DLQ_NAME, durable=True)
+        for attempt in range(1, CONSUMER_MAX_ATTEMPTS):
+            ch.queue_declare(
+                queue=retry_queue(attempt),
+                durable=True,
+                arguments={
+                    "x-message-ttl": retry_ttl(attempt),
+                    "x-dead-letter-exchange": "",
+                    "x-dead-letter-routing-key": QUEUE_NAME,
+                },
+            )
+
+    def consume(self):
+        self.start_loop()
+        while True:
+            try:
+                with BlockingConnection(self.params) as conn:
+                    with conn.channel() as ch:
+                        self.conn, self.channel = conn, ch
+                        self.declare(ch)
+                        # Retry/DLQ republishes must be confirmed before the original is acked.
+                        ch.confirm_delivery()
+                        ch.basic_qos(prefetch_count=CONSUMER_PREFETCH)
+                        ch.basic_consume(queue=QUEUE_NAME, on_message_callback=self.on_message)
+                        conn.call_later(CONSUMER_STATS_INTERVAL, self.log_stats)
+                        ch.start_consuming()
+            except AMQPError as e:
+                log.warning(f"RabbitMQ connection lost: {e!r}")
+                time.sleep(CONSUMER_RECONNECT_DELAY)
+
+    def log_stats(self):
+        log.info("Consumer stats %s", stats.snapshot())
+        self.conn.call_later(CONSUMER_STATS_INTERVAL, self.log_stats)
+
+    def on_message(self, ch, method, properties, body):
+        lag = time.time() - properties.timestamp if properties.timestamp else None
+        stats.receive(lag)
+        start = time.monotonic()
+
+        try:
+            task = json.loads(body.decode("utf-8"))
+        except ValueError:
+            log.error("Malformed message, moving to DLQ")
+            self.finish(ch, method, properties, body, PermanentError("malformed"), start)
+            return
+
+        log.debug("Получено сообщение: %s", task.get("type"))
+        attempt = int((properties.headers or {}).get("x-attempt", 1))
+        future = asyncio.run_coroutine_threadsafe(self._run(task, attempt >= CONSUMER_MAX_ATTEMPTS), self.loop)
+        conn = self.conn
+        future.add_done_callback(
+            lambda f: conn.add_callback_threadsafe(
+                lambda: self.finish(ch, method, properties, body, outcome(f), start)))
+
+    def finish(self, ch, method, properties, body, error: BaseException | None, start: float):
+        if not ch.is_open:
+            stats.finish("lost", time.monotonic() - start)
+            return
+
+        if error is None:
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            stats.finish("ack", time.monotonic() - start)
+            return
+
+        headers = dict(properties.headers or {})
+        attempt = int(headers.get("x-attempt", 1))
+        if isinstance(error, PermanentError) or attempt >= CONSUMER_MAX_ATTEMPTS:
+            routing_key, outcome = DLQ_NAME, "dead"
+            headers["x-error"] = str(error)[:255]
+            log.error(f"Task failed after {attempt} attempts, moving to DLQ: {error}")
+        else:
+            routing_key, outcome = retry_queue(attempt), "retry"
+            headers["x-attempt"] = attempt + 1
+            log.warning(f"Task attempt {attempt} failed, retry in {retry_delay(attempt)}s: {error}")
+
+        try:
+            ch.basic_publish(
+                exchange="",
+                routing_key=routing_key,
+                body=body,
+                properties=BasicProperties(
+                    content_type=properties.content_type,
+                    delivery_mode=2,
+                    timestamp=properties.timestamp,
+                    headers=headers,
+                ),
+                mandatory=True,
+            )
+        except (NackError, UnroutableError) as e:
+            log.error(f"Republish to {routing_key} was not confirmed, requeueing the original: {e}")
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            stats.finish("requeued", time.monotonic() - start)
+            return
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        stats.finish(outcome, time.monotonic() - start)
+
 
 def consume_task():
     params = ConnectionParameters(
@@ -21,28 +358,11 @@ def consume_task():
         port=RABBITMQ_PORT,
         credentials=credentials,
     )
-    while True:
-        with BlockingConnection(params) as conn:
-            with conn.channel() as ch:
-                ch.queue_declare(queue="messages", durable=True)
-                ch.basic_consume(queue="messages",
-                                 on_message_callback=process_task)
-                ch.start_consuming()
-
-
-def process_task(ch, method, properties, body):
-    task = json.loads(body.decode("utf-8"))
-    logging.info(f"Получено сообщение: {task}")
-    task_type = task.get("type")
-    if task_type == "update_loyalty":
-        username = task["username"]
-        delta = task.get("delta")
-        try:
-            update_loyalty(username, delta)
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-        except Exception:
-            time.sleep(10)
-            ch.basic_nack(delivery_tag=method.delivery_tag)
+    if not SERVICE_TOKEN:
+        log.warning("SERVICE_TOKEN is not set: tasks without user credentials will be rejected downstream")
+    if CONSUMER_METRICS_PORT:
+        start_metrics_server(CONSUMER_METRICS_PORT)
+    Worker(params).consume()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,101 @@
+import os
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "10.0"))
+
+DEADLINE_HEADER = "X-Request-Timeout-Ms"
+
+current_deadline: ContextVar[float | None] = ContextVar("current_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self):
+        super().__init__("Request deadline exceeded")
+
+
+def remaining() -> float | None:
+    deadline = current_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check_deadline():
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded()
+
+
+def timeout_for(default: float) -> float:
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise DeadlineExceeded()
+    return min(default, left)
+
+
+def deadline_headers() -> dict:
+    left = remaining()
+    if left is None:
+        return {}
+    return {DEADLINE_HEADER: str(max(int(left * 1000), 0))}
+
+
+@contextmanager
+def without_deadline():
+    token = current_deadline.set(None)
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+
+def parse_budget(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return max(int(value), 0) / 1000
+    except ValueError:
+        return None
+
+
+class DeadlineMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        budget = None
+        for k, v in scope["headers"]:
+            if k.decode("latin-1").lower() == DEADLINE_HEADER.lower():
+                budget = parse_budget(v.decode("latin-1"))
+                break
+        if REQUEST_DEADLINE > 0:
+            budget = REQUEST_DEADLINE if budget is None else min(budget, REQUEST_DEADLINE)
+
+        if budget is None:
+            await self.app(scope, receive, send)
+            return
+
+        if budget <= 0:
+            body = json.dumps({"message": "Превышено время ожидания"}, ensure_ascii=False).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 504,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        token = current_deadline.set(time.monotonic() + budget)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_deadline.reset(token)
@@ -0,0 +1,63 @@
+import os
+import threading
+from collections import deque
+from .retry import RetryBudget
+from .metrics import Counter
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "0") == "1"
+HEDGE_DELAY = float(os.getenv("HEDGE_DELAY", "0.1"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.01"))
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_SAMPLE_SIZE = int(os.getenv("HEDGE_SAMPLE_SIZE", "200"))
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.05"))
+HEDGE_BUDGET_MAX = float(os.getenv("HEDGE_BUDGET_MAX", "10"))
+
+hedges = Counter(
+    "http_client_hedges_total",
+    "Hedged downstream requests",
+    ("service", "outcome"),
+)
+
+
+class LatencyTracker:
+    def __init__(self, size: int = 200, percentile: float = 0.95, min_samples: int = 20):
+        self.size = size
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.samples = {}
+        self.cached = {}
+        self.lock = threading.Lock()
+
+    def observe(self, route: str, value: float):
+        with self.lock:
+            samples = self.samples.get(route)
+            if samples is None:
+                samples = self.samples[route] = deque(maxlen=self.size)
+            samples.append(value)
+            if len(samples) % 10 == 0:
+                self.cached.pop(route, None)
+
+    def quantile(self, route: str) -> float | None:
+        with self.lock:
+            value = self.cached.get(route)
+            if value is not None:
+                return value
+            samples = self.samples.get(route)
+            if samples is None or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+            value = ordered[min(int(len(ordered) * self.percentile), len(ordered) - 1)]
+            self.cached[route] = value
+            return value
+
+
+latency = LatencyTracker(HEDGE_SAMPLE_SIZE, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+hedge_budget = RetryBudget(HEDGE_MAX_RATIO, 0.0, HEDGE_BUDGET_MAX)
+
+
+def hedge_delay(route: str | None) -> float | None:
+    if not HEDGE_ENABLED or route is None:
+        return None
+    observed = latency.quantile(route)
+    return max(HEDGE_MIN_DELAY, observed if observed is not None else HEDGE_DELAY)
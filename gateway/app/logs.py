@@ -0,0 +1,104 @@
+import os
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_CALL_SAMPLE_RATE = float(os.getenv("LOG_CALL_SAMPLE_RATE", "0.01"))
+LOG_CALL_SAMPLE_RATES = os.getenv("LOG_CALL_SAMPLE_RATES", "")
+LOG_SLOW_CALL = float(os.getenv("LOG_SLOW_CALL", "0.5"))
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+RESERVED_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+calls_log = logging.getLogger("gateway.calls")
+
+listener: logging.handlers.QueueListener | None = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in RESERVED_ATTRS})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging():
+    global listener
+    if listener is not None:
+        return
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    root.addHandler(DroppingQueueHandler(log_queue))
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("httpcore").setLevel(logging.WARNING)
+
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+
+def parse_sample_rates(value: str) -> dict:
+    rates = {}
+    for item in value.split(","):
+        route, sep, rate = item.rpartition("=")
+        if sep and route.strip():
+            rates[route.strip()] = float(rate)
+    return rates
+
+
+sample_rates = parse_sample_rates(LOG_CALL_SAMPLE_RATES)
+
+
+def log_call(service: str, route: str | None, duration: float, error: BaseException | None = None):
+    if error is None and duration < LOG_SLOW_CALL:
+        rate = sample_rates.get(route, LOG_CALL_SAMPLE_RATE)
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return
+        level = logging.INFO
+    else:
+        level = logging.WARNING
+    if not calls_log.isEnabledFor(level):
+        return
+
+    extra = {"service": service, "route": route, "duration": round(duration, 6), "outcome": "ok"}
+    if error is not None:
+        response = getattr(error, "response", None)
+        extra["status"] = response.status_code if response is not None else None
+        extra["outcome"] = type(error).__name__
+    calls_log.log(level, "%s %s %.1fms %s", service, route, duration * 1000, extra["outcome"], extra=extra)
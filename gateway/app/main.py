@@ -1,20 +1,92 @@
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
+import os
+import hmac
+from contextlib import asynccontextmanager
+from uuid import UUID
+from fastapi import FastAPI, HTTPException, Request, Body
+from fastapi.responses import JSONResponse, Response
 from .api import router
-from .auth import router as authorize_router
+from .auth import router as authorize_router, verifier
+from .clients import (start_client, close_client, invalidate_hotels, hotel_cache, hotels_page_cache,
+                      loyalty_last_known)
+from .producer import publisher
+from .outbox import OutboxFull
+from .responses import FastJSONResponse
+from .tracing import TracingMiddleware
+from .deadline import DeadlineMiddleware
+from .metrics import MetricsMiddleware, CallbackMetric, render, CONTENT_TYPE
 
-app = FastAPI(title="Gateway API")
+CACHE_INVALIDATION_TOKEN = os.getenv("CACHE_INVALIDATION_TOKEN")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_client()
+    verifier.prefetch()
+    publisher.start()
+    yield
+    publisher.stop()
+    await close_client()
+
+
+app = FastAPI(title="Gateway API", lifespan=lifespan, default_response_class=FastJSONResponse)
+
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(DeadlineMiddleware)
+app.add_middleware(TracingMiddleware)
 
 app.include_router(authorize_router)
 app.include_router(router)
 
+CallbackMetric(
+    "rabbitmq_publisher_messages",
+    "RabbitMQ publisher and outbox counters (pending, oldestPendingAge, published, connections, rejected)",
+    "gauge",
+    ("kind",),
+    lambda: [((k,), v) for k, v in publisher.stats().items()],
+)
+CallbackMetric(
+    "cache_operations",
+    "In-process cache counters",
+    "gauge",
+    ("cache", "kind"),
+    lambda: [((c.name, k), v) for c in (hotel_cache, hotels_page_cache, loyalty_last_known) for k, v in c.stats().items()],
+)
+CallbackMetric(
+    "jwt_cache_operations",
+    "Verified JWT cache counters",
+    "gauge",
+    ("kind",),
+    lambda: [((k,), v) for k, v in verifier.stats().items()],
+)
+
 @app.get("/manage/health")
 def health():
     return {"gateway": "ok"}
 
+@app.get("/manage/metrics")
+def metrics():
+    return Response(content=render(), media_type=CONTENT_TYPE)
+
+@app.post("/manage/cache/hotels/invalidate", status_code=204)
+async def invalidate_hotels_cache(request: Request, hotelUid: UUID | None = Body(None, embed=True)):
+    # Refused outright when no token is configured: the route is served on the public gateway port.
+    token = request.headers.get("X-Invalidation-Token") or ""
+    if not CACHE_INVALIDATION_TOKEN or not hmac.compare_digest(token.encode(), CACHE_INVALIDATION_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Доступ запрещён")
+    invalidate_hotels(hotelUid)
+
+
 @app.exception_handler(HTTPException)
 def http_exception_handler(request: Request, exc: HTTPException):
     return JSONResponse(
         status_code=exc.status_code,
         content={"message": exc.detail},
-    )
\ No newline at end of file
+    )
+
+
+@app.exception_handler(OutboxFull)
+def outbox_full_handler(request: Request, exc: OutboxFull):
+    return JSONResponse(
+        status_code=503,
+        content={"message": "Очередь задач переполнена"},
+    )
@@ -38,6 +38,27 @@ class PaginationResponse(BaseModel):
     pageSize: int
     totalElements: int
     items: List[HotelResponse]
+    nextCursor: Optional[str] = None
+
+
+class HotelSearchResponse(BaseModel):
+    pageSize: int
+    items: List[HotelResponse]
+    nextCursor: Optional[str] = None
+
+
+class NightAvailability(BaseModel):
+    date: date
+    freeRooms: int
+
+
+class AvailabilityResponse(BaseModel):
+    hotelUid: UUID
+    startDate: date
+    endDate: date
+    available: bool
+    freeRooms: int
+    nights: List[NightAvailability]
 
 
 class HotelInfo(BaseModel):
@@ -65,11 +86,13 @@ class LoyaltyInfoResponse(BaseModel):
     status: LoyaltyLevel
     discount: int
     reservationCount: int
+    stale: Optional[bool] = None
 
 
 class UserInfoResponse(BaseModel):
     reservations: List[ReservationResponse]
     loyalty: LoyaltyInfoResponse | dict
+    partial: Optional[bool] = None
 
 
 class CreateReservationRequest(BaseModel):
@@ -88,6 +111,31 @@ class CreateReservationResponse(BaseModel):
     payment: PaymentInfo
 
 
+class BookingStatus(str, Enum):
+    PENDING = "PENDING"
+    COMPLETED = "COMPLETED"
+    FAILED = "FAILED"
+
+
+class BookingAcceptedResponse(BaseModel):
+    bookingUid: UUID
+    status: BookingStatus
+    statusUrl: str
+
+
+class BookingResponse(BaseModel):
+    bookingUid: UUID
+    hotelUid: UUID
+    startDate: date
+    endDate: date
+    status: BookingStatus
+    step: str
+    price: Optional[int] = None
+    discount: Optional[int] = None
+    reservationUid: Optional[UUID] = None
+    error: Optional[str] = None
+
+
 class ErrorDescription(BaseModel):
     field: str | None = None
     error: str
@@ -105,6 +153,35 @@ class ValidationErrorResponse(BaseModel):
 class GetHotelsQuery(BaseModel):
     page: int = Field(0, ge=0)
     size: int = Field(1, ge=1, le=100)
+    cursor: Optional[str] = None
+
+
+class HotelSortField(str, Enum):
+    PRICE = "price"
+    STARS = "stars"
+
+
+class SortOrder(str, Enum):
+    ASC = "asc"
+    DESC = "desc"
+
+
+class SearchHotelsQuery(BaseModel):
+    city: Optional[str] = Field(None, max_length=80)
+    country: Optional[str] = Field(None, max_length=80)
+    starsMin: Optional[int] = Field(None, ge=0)
+    starsMax: Optional[int] = Field(None, ge=0)
+    priceMin: Optional[int] = Field(None, ge=0)
+    priceMax: Optional[int] = Field(None, ge=0)
+    sortBy: HotelSortField = HotelSortField.PRICE
+    order: SortOrder = SortOrder.ASC
+    size: int = Field(20, ge=1, le=100)
+    cursor: Optional[str] = None
+
+
+class AvailabilityQuery(BaseModel):
+    startDate: date
+    endDate: date
 
 
 class AuthorizeRequest(BaseModel):
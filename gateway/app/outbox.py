@@ -0,0 +1,67 @@
+import sqlite3
+import threading
+import time
+
+
+class OutboxFull(Exception):
+    pass
+
+
+class Outbox:
+    def __init__(self, path: str, max_pending: int = 0):
+        self.path = path
+        self.max_pending = max_pending
+        self.conn = None
+        self.lock = threading.Lock()
+        self.pending = 0
+
+    def open(self):
+        with self.lock:
+            if self.conn is not None:
+                return
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL;")
+            self.conn.execute("PRAGMA synchronous=NORMAL;")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox
+                (
+                    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                    body       BLOB NOT NULL,
+                    created_at REAL NOT NULL
+                );
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS outbox_created_at ON outbox (created_at);")
+            self.pending = self.conn.execute("SELECT COUNT(*) FROM outbox;").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def add(self, body: bytes):
+        self.open()
+        with self.lock:
+            # A broker outage would otherwise grow the file until the volume fills; refuse new work instead.
+            if self.max_pending and self.pending >= self.max_pending:
+                raise OutboxFull(f"Outbox holds {self.pending} unpublished messages")
+            self.conn.execute("INSERT INTO outbox (body, created_at) VALUES (?, ?);", (body, time.time()))
+            self.pending += 1
+
+    def fetch(self, limit: int) -> list[tuple[int, bytes]]:
+        self.open()
+        with self.lock:
+            return self.conn.execute("SELECT id, body FROM outbox ORDER BY id LIMIT ?;", (limit,)).fetchall()
+
+    def remove(self, ids: list[int]):
+        if not ids:
+            return
+        with self.lock:
+            self.conn.execute(f"DELETE FROM outbox WHERE id IN ({','.join('?' * len(ids))});", ids)
+            self.pending -= len(ids)
+
+    def oldest_age(self) -> float:
+        self.open()
+        with self.lock:
+            row = self.conn.execute("SELECT MIN(created_at) FROM outbox;").fetchone()
+        return time.time() - row[0] if row[0] is not None else 0.0
@@ -1,28 +1,204 @@
-from pika import BlockingConnection, ConnectionParameters, PlainCredentials
+from pika import BasicProperties, BlockingConnection, ConnectionParameters, PlainCredentials
+from pika.exceptions import AMQPError
+import asyncio
 import json
+import logging
 import os
-
+import threading
+import time
+from .outbox import Outbox, OutboxFull
 
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
 RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT"))
 RABBITMQ_USER = os.getenv("RABBITMQ_USER")
 RABBITMQ_PASSWORD = os.getenv("RABBITMQ_PASSWORD")
 
+PUBLISH_BATCH_SIZE = int(os.getenv("PUBLISH_BATCH_SIZE", "100"))
+PUBLISH_FLUSH_INTERVAL = float(os.getenv("PUBLISH_FLUSH_INTERVAL", "0"))
+PUBLISH_BACKOFF_MAX = float(os.getenv("PUBLISH_BACKOFF_MAX", "30.0"))
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", "outbox.db")
+OUTBOX_MAX_PENDING = int(os.getenv("OUTBOX_MAX_PENDING", "100000"))
+
+QUEUE_NAME = "messages"
+
 credentials = PlainCredentials(RABBITMQ_USER, RABBITMQ_PASSWORD)
 
+log = logging.getLogger("producer")
+
+
+class Publisher:
+    def __init__(self, params: ConnectionParameters, queue_name: str, outbox: Outbox, batch_size: int = 100,
+                 flush_interval: float = 0.0, backoff_max: float = 30.0, idle_wait: float = 1.0,
+                 stop_flush_timeout: float = 5.0):
+        self.params = params
+        self.queue_name = queue_name
+        self.outbox = outbox
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.backoff_max = backoff_max
+        self.idle_wait = idle_wait
+        self.stop_flush_timeout = stop_flush_timeout
+
+        self.conn = None
+        self.channel = None
+        self.backoff = 0.0
+        self.retry_at = 0.0
+
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.wake = threading.Event()
+
+        self.published = 0
+        self.connections = 0
+        self.rejected = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.outbox.open()
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name="publisher", daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self.stopping.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                # Still flushing: the relay thread owns the connection and the outbox and closes them on exit.
+                log.warning("Publisher still flushing after %ss, leaving shutdown to the relay thread", timeout)
+                return
+            self.thread = None
+        self.disconnect()
+        self.outbox.close()
+
+    def publish(self, body: bytes):
+        try:
+            self.outbox.add(body)
+        except OutboxFull:
+            self.rejected += 1
+            raise
+        self.start()
+        self.wake.set()
+
+    def connect(self):
+        self.conn = BlockingConnection(self.params)
+        self.channel = self.conn.channel()
+        self.channel.queue_declare(queue=self.queue_name, durable=True)
+        self.channel.confirm_delivery()
+        self.connections += 1
+
+    def disconnect(self):
+        try:
+            if self.conn is not None and self.conn.is_open:
+                self.conn.close()
+        except AMQPError:
+            pass
+        self.conn = None
+        self.channel = None
+
+    def connected(self) -> bool:
+        if self.conn is not None and self.conn.is_open and self.channel is not None and self.channel.is_open:
+            return True
+        if time.monotonic() < self.retry_at:
+            return False
 
-def publish_task(task: dict):
-    params = ConnectionParameters(
+        self.disconnect()
+        try:
+            self.connect()
+        except AMQPError as e:
+            self.backoff = min(self.backoff * 2 or 0.5, self.backoff_max)
+            self.retry_at = time.monotonic() + self.backoff
+            log.warning(f"RabbitMQ unavailable, retry in {self.backoff}s: {e}")
+            return False
+
+        self.backoff = 0.0
+        return True
+
+    def next_batch(self) -> list[tuple[int, bytes]]:
+        self.wake.clear()
+        batch = self.outbox.fetch(self.batch_size)
+        if not batch:
+            self.wake.wait(self.idle_wait)
+            return batch
+
+        if len(batch) < self.batch_size and self.flush_interval > 0:
+            self.stopping.wait(self.flush_interval)
+            batch = self.outbox.fetch(self.batch_size)
+        return batch
+
+    def send(self, batch: list[tuple[int, bytes]]) -> bool:
+        properties = BasicProperties(content_type="application/json", delivery_mode=2, timestamp=int(time.time()))
+        sent = []
+        for message_id, body in batch:
+            try:
+                self.channel.basic_publish(
+                    exchange="",
+                    routing_key=self.queue_name,
+                    body=body,
+                    properties=properties,
+                    mandatory=True,
+                )
+            except AMQPError as e:
+                log.warning(f"Publish failed, {len(batch) - len(sent)} messages stay in the outbox: {e}")
+                self.disconnect()
+                break
+            sent.append(message_id)
+
+        self.outbox.remove(sent)
+        self.published += len(sent)
+        return len(sent) == len(batch)
+
+    def run(self):
+        while not self.stopping.is_set():
+            if not self.connected():
+                self.stopping.wait(min(max(self.retry_at - time.monotonic(), 0.05), self.idle_wait))
+                continue
+
+            batch = self.next_batch()
+            if batch:
+                self.send(batch)
+            else:
+                try:
+                    self.conn.process_data_events(0)
+                except AMQPError:
+                    self.disconnect()
+
+        deadline = time.monotonic() + self.stop_flush_timeout
+        while self.outbox.pending and time.monotonic() < deadline and self.connected():
+            if not self.send(self.outbox.fetch(self.batch_size)):
+                break
+        self.disconnect()
+        self.outbox.close()
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.outbox.pending,
+            "oldestPendingAge": round(self.outbox.oldest_age(), 3),
+            "published": self.published,
+            "connections": self.connections,
+            "rejected": self.rejected,
+        }
+
+
+publisher = Publisher(
+    ConnectionParameters(
         host=RABBITMQ_HOST,
         port=RABBITMQ_PORT,
         credentials=credentials,
-    )
+    ),
+    QUEUE_NAME,
+    Outbox(OUTBOX_PATH, max_pending=OUTBOX_MAX_PENDING),
+    batch_size=PUBLISH_BATCH_SIZE,
+    flush_interval=PUBLISH_FLUSH_INTERVAL,
+    backoff_max=PUBLISH_BACKOFF_MAX,
+)
+
+
+async def publish_task(task: dict):
+    # The outbox INSERT is a blocking sqlite write; keep it off the event loop.
     body = json.dumps(task).encode("utf-8")
-    with BlockingConnection(params) as conn:
-        with conn.channel() as ch:
-            ch.queue_declare(queue="messages", durable=True)
-            ch.basic_publish(
-                exchange="",
-                routing_key="messages",
-                body=body
-            )
\ No newline at end of file
+    await asyncio.to_thread(publisher.publish, body)
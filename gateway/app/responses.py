@@ -0,0 +1,43 @@
+import os
+from typing import Any
+from pydantic import TypeAdapter
+from pydantic_core import to_json
+from fastapi.responses import JSONResponse, Response
+
+RESPONSE_TRUST_DOWNSTREAM = os.getenv("RESPONSE_TRUST_DOWNSTREAM", "0") == "1"
+
+_adapters: dict[Any, TypeAdapter] = {}
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
+
+
+def _adapter(tp) -> TypeAdapter:
+    adapter = _adapters.get(tp)
+    if adapter is None:
+        adapter = _adapters[tp] = TypeAdapter(tp)
+    return adapter
+
+
+def dump_json(tp, value: Any, exclude_none: bool = False, trusted: bool = False) -> bytes:
+    # Validates the payload against tp exactly once and encodes it straight to bytes.
+    # Trusted payloads already have the response shape and skip validation when RESPONSE_TRUST_DOWNSTREAM is on;
+    # exclude_none then only drops top-level keys.
+    if trusted and RESPONSE_TRUST_DOWNSTREAM:
+        if exclude_none:
+            value = {k: v for k, v in value.items() if v is not None}
+        return to_json(value)
+    adapter = _adapter(tp)
+    return adapter.dump_json(adapter.validate_python(value), exclude_none=exclude_none)
+
+
+def model_response(tp, value: Any, status_code: int = 200, exclude_none: bool = False, trusted: bool = False,
+                   headers: dict | None = None) -> Response:
+    return Response(
+        content=dump_json(tp, value, exclude_none, trusted),
+        status_code=status_code,
+        headers=headers,
+        media_type="application/json",
+    )
@@ -0,0 +1,94 @@
+import os
+import time
+import random
+import threading
+import httpx
+from .deadline import remaining, DeadlineExceeded
+from .metrics import Counter
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BACKOFF_BASE = float(os.getenv("RETRY_BACKOFF_BASE", "0.05"))
+RETRY_BACKOFF_MAX = float(os.getenv("RETRY_BACKOFF_MAX", "1.0"))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv("RETRY_BUDGET_MIN_PER_SECOND", "1.0"))
+RETRY_BUDGET_MAX = float(os.getenv("RETRY_BUDGET_MAX", "100"))
+
+RETRYABLE_STATUSES = {502, 503, 504}
+
+retries = Counter(
+    "http_client_retries_total",
+    "Retries of idempotent downstream calls",
+    ("service", "outcome"),
+)
+
+
+class RetryBudget:
+    def __init__(self, ratio: float = 0.1, min_per_second: float = 1.0, max_tokens: float = 100):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.max_tokens, self.tokens + (now - self.updated) * self.min_per_second)
+        self.updated = now
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+retry_budget = RetryBudget(RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN_PER_SECOND, RETRY_BUDGET_MAX)
+
+
+def idempotent(route: str | None) -> bool:
+    return route is not None and (route.startswith("GET ") or route.endswith(":batchGet"))
+
+
+def client_error(error: BaseException) -> bool:
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code < 500
+
+
+def deadline_error(error: BaseException) -> bool:
+    # The caller ran out of its own budget: either before sending, or in a timeout shortened below HTTP_TIMEOUT.
+    if isinstance(error, DeadlineExceeded):
+        return True
+    if not isinstance(error, httpx.TimeoutException):
+        return False
+    try:
+        return bool(error.request.extensions.get("deadline_bound"))
+    except RuntimeError:
+        return False
+
+
+def retryable(error: BaseException) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUSES
+    return isinstance(error, httpx.TransportError)
+
+
+def retry_delay(service: str, route: str | None, attempt: int, error: BaseException) -> float | None:
+    if attempt + 1 >= RETRY_MAX_ATTEMPTS or not idempotent(route) or not retryable(error):
+        return None
+
+    delay = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt))
+    left = remaining()
+    if left is not None and left <= delay:
+        retries.inc(service, "deadline")
+        return None
+    if not retry_budget.withdraw():
+        retries.inc(service, "budget_exhausted")
+        return None
+
+    retries.inc(service, "retried")
+    return delay
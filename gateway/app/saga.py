@@ -0,0 +1,102 @@
+import asyncio
+import logging
+from datetime import date
+from uuid import uuid4
+import httpx
+from .clients import (fetch_booking, update_booking, complete_booking, fetch_hotel, fetch_user_loyalty,
+                      create_payment, cancel_payment, update_loyalty, revert_loyalty, ServiceAuth)
+from .utils import calculate_price
+
+log = logging.getLogger("saga")
+
+PERMANENT_STATUSES = (400, 401, 403, 404, 409, 422)
+
+
+class SagaFailed(Exception):
+    pass
+
+
+def permanent(error: BaseException) -> bool:
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code in PERMANENT_STATUSES
+
+
+def loyalty_operation(booking: dict) -> str:
+    return f"booking:{booking['bookingUid']}"
+
+
+async def advance(booking: dict, auth: str):
+    # Every side effect is keyed by something recorded on the booking before the call (the paymentUid,
+    # the booking uid for loyalty), so a redelivered task repeats the call without repeating its effect.
+    uid = booking["bookingUid"]
+    step = booking["step"]
+
+    if step == "ACCEPTED":
+        if not booking.get("paymentUid"):
+            hotel, loyalty = await asyncio.gather(
+                fetch_hotel(booking["hotelUid"], auth),
+                fetch_user_loyalty(auth),
+            )
+            if not hotel:
+                raise SagaFailed(f"Отель с UID {booking['hotelUid']} не найден")
+            discount = (loyalty or {}).get("discount", 0)
+            price = calculate_price(
+                date.fromisoformat(booking["startDate"]), date.fromisoformat(booking["endDate"]), hotel["price"], discount)
+            booking.update(await update_booking(
+                uid, {"paymentUid": str(uuid4()), "price": price, "discount": discount}, auth))
+
+        await create_payment(booking["price"], auth, booking["paymentUid"])
+        booking.update(await update_booking(uid, {"step": "PAYMENT_CREATED"}, auth))
+        step = booking["step"]
+
+    if step == "PAYMENT_CREATED":
+        await update_loyalty(auth, 1, loyalty_operation(booking))
+        booking.update(await update_booking(uid, {"step": "LOYALTY_UPDATED"}, auth))
+        step = booking["step"]
+
+    if step == "LOYALTY_UPDATED":
+        booking.update(await complete_booking(uid, auth))
+
+
+async def compensate(booking: dict, auth: str):
+    # Both undo calls are idempotent, so compensation does not record intermediate steps. A paymentUid on an
+    # ACCEPTED booking means the payment may exist even though PAYMENT_CREATED was never recorded.
+    uid = booking["bookingUid"]
+
+    if booking["step"] in ("PAYMENT_CREATED", "LOYALTY_UPDATED"):
+        await revert_loyalty(loyalty_operation(booking), auth)
+
+    if booking.get("paymentUid"):
+        try:
+            await cancel_payment(booking["paymentUid"], auth)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 404:
+                raise
+            log.info("Booking %s: payment %s was never created", uid, booking["paymentUid"])
+
+    booking.update(await update_booking(uid, {"step": "COMPENSATED"}, auth))
+
+
+async def run_booking(task: dict, final_attempt: bool = False):
+    uid = task.get("bookingUid")
+    if not uid or not (task.get("auth") or task.get("username")):
+        raise SagaFailed("booking task without bookingUid or username")
+    # Steps run under the service credential on behalf of the booking's user; tasks queued by older gateways
+    # may still carry the user's token instead.
+    auth = task.get("auth") or ServiceAuth(task["username"])
+
+    booking = await fetch_booking(uid, auth)
+
+    if booking["status"] == "PENDING":
+        try:
+            await advance(booking, auth)
+            log.info("Booking %s completed", uid)
+            return
+        except Exception as e:
+            if not (final_attempt or permanent(e) or isinstance(e, SagaFailed)):
+                raise
+            log.warning("Booking %s failed at step %s: %s", uid, booking["step"], e)
+            booking.update(await update_booking(uid, {"status": "FAILED", "error": str(e)[:255] or type(e).__name__}, auth))
+
+    if booking["status"] == "FAILED" and booking["step"] != "COMPENSATED":
+        await compensate(booking, auth)
+        log.info("Booking %s compensated", uid)
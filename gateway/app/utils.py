@@ -1,9 +1,12 @@
+import httpx
 from fastapi import HTTPException
 from .models import *
 from .circuit_breaker import CircuitBreakerError
+from .deadline import DeadlineExceeded
+from .logs import setup_logging
 import logging
 
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 
 
 def calculate_price(start_date: date, end_date: date, price_per_night: int, discount_percent: int) -> int:
@@ -19,9 +22,9 @@ def fallback_for_service(service_name: str):
         return None
 
 
-def handle_service_errors(service_name: str, func, *args, fallback: bool = False, **kwargs):
+async def handle_service_errors(service_name: str, func, *args, fallback: bool = False, **kwargs):
     try:
-        return func(*args, **kwargs)
+        return await func(*args, **kwargs)
     except CircuitBreakerError as e:
         logging.info(e)
         if fallback:
@@ -33,6 +36,20 @@ def handle_service_errors(service_name: str, func, *args, fallback: bool = False
         logging.info(e)
         raise
 
+    except DeadlineExceeded as e:
+        logging.info(e)
+        if fallback:
+            return fallback_for_service(service_name)
+        raise HTTPException(status_code=504, detail="Превышено время ожидания")
+
+    except httpx.HTTPStatusError as e:
+        logging.info(e)
+        if e.response.status_code == 409:
+            raise HTTPException(status_code=409, detail=e.response.json().get("message"))
+        if fallback:
+            return fallback_for_service(service_name)
+        raise HTTPException(status_code=503, detail=f"{service_name.capitalize()} Service unavailable")
+
     except Exception as e:
         logging.info(e)
         if fallback:
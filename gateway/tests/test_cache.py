@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from app.cache import AsyncTTLCache
+
+
+def test_concurrent_misses_share_one_load():
+    cache = AsyncTTLCache("test", ttl=60.0)
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"value": 1}
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_load("key", loader) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == [{"value": 1}] * 5
+    assert len(calls) == 1
+    assert not cache.in_flight
+
+
+def test_cancelled_first_caller_does_not_cancel_other_waiters():
+    cache = AsyncTTLCache("test", ttl=60.0)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def loader():
+            await release.wait()
+            return {"value": 1}
+
+        first = asyncio.ensure_future(cache.get_or_load("key", loader))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.get_or_load("key", loader))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+        release.set()
+        return await second
+
+    assert asyncio.run(scenario()) == {"value": 1}
+    assert cache.get_stale("key") == {"value": 1}
+
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    cache = AsyncTTLCache("test", ttl=60.0)
+
+    async def loader():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("down")
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_load("key", loader) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert cache.get_stale("key") is None
+    assert not cache.in_flight
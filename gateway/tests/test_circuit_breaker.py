@@ -0,0 +1,222 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from app.circuit_breaker import CircuitBreaker, CircuitBreakerError, _attempt
+from app.deadline import DeadlineExceeded
+
+
+def make_breaker(**kwargs) -> CircuitBreaker:
+    params = {"threshold": 2, "window": 60.0, "timeout": 0.05, "half_open_limit": 2, "name": "test"}
+    params.update(kwargs)
+    return CircuitBreaker(**params)
+
+
+def open_breaker(breaker: CircuitBreaker):
+    for _ in range(breaker.threshold):
+        assert breaker.request_available()
+        breaker.record(False)
+    assert breaker.state == "OPEN"
+
+
+def wait_timeout(breaker: CircuitBreaker):
+    time.sleep(breaker.timeout + 0.01)
+
+
+def attempt(breaker: CircuitBreaker, func):
+    return _attempt("test", breaker, "test", None, func, (), {})
+
+
+async def ok():
+    return "ok"
+
+
+async def fail():
+    raise httpx.ConnectError("down")
+
+
+def test_opens_after_threshold_failures():
+    breaker = make_breaker()
+    open_breaker(breaker)
+    assert not breaker.request_available()
+
+
+def test_failures_outside_window_do_not_open():
+    breaker = make_breaker(window=0.01)
+    breaker.record(False)
+    time.sleep(0.02)
+    breaker.record(False)
+    assert breaker.state == "CLOSED"
+
+
+def test_success_clears_errors():
+    breaker = make_breaker()
+    breaker.record(False)
+    breaker.record(True)
+    breaker.record(False)
+    assert breaker.state == "CLOSED"
+
+
+def test_slow_success_counts_as_failure():
+    breaker = make_breaker(slow_call_threshold=0.1)
+    breaker.record(True, 0.5)
+    breaker.record(True, 0.5)
+    assert breaker.state == "OPEN"
+
+
+def test_half_open_closes_after_limit_successes():
+    breaker = make_breaker()
+    open_breaker(breaker)
+    wait_timeout(breaker)
+
+    assert breaker.request_available()
+    assert breaker.state == "HALF_OPEN"
+    assert breaker.request_available()
+    assert not breaker.request_available()
+
+    breaker.record(True)
+    assert breaker.state == "HALF_OPEN"
+    breaker.record(True)
+    assert breaker.state == "CLOSED"
+
+
+def test_half_open_failure_reopens():
+    breaker = make_breaker()
+    open_breaker(breaker)
+    wait_timeout(breaker)
+
+    assert breaker.request_available()
+    breaker.record(False)
+    assert breaker.state == "OPEN"
+    assert not breaker.request_available()
+
+
+def test_half_open_with_lost_probes_restarts_after_timeout():
+    breaker = make_breaker()
+    open_breaker(breaker)
+    wait_timeout(breaker)
+
+    assert breaker.request_available()
+    assert breaker.request_available()
+    assert not breaker.request_available()
+
+    wait_timeout(breaker)
+    assert breaker.request_available()
+    assert breaker.state == "HALF_OPEN"
+
+
+def test_open_breaker_rejects_attempt():
+    breaker = make_breaker()
+    open_breaker(breaker)
+    with pytest.raises(CircuitBreakerError):
+        asyncio.run(attempt(breaker, ok))
+
+
+def test_client_error_is_not_a_failure():
+    breaker = make_breaker(threshold=1)
+
+    async def not_found():
+        request = httpx.Request("GET", "http://test")
+        raise httpx.HTTPStatusError("not found", request=request, response=httpx.Response(404, request=request))
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(attempt(breaker, not_found))
+    assert breaker.state == "CLOSED"
+
+
+def test_transport_error_is_a_failure():
+    breaker = make_breaker(threshold=1)
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(attempt(breaker, fail))
+    assert breaker.state == "OPEN"
+
+
+def test_cancelled_probe_releases_half_open_slot():
+    breaker = make_breaker()
+    open_breaker(breaker)
+    wait_timeout(breaker)
+
+    async def scenario():
+        started = asyncio.Event()
+
+        async def hang():
+            started.set()
+            await asyncio.sleep(10)
+
+        probe = asyncio.ensure_future(attempt(breaker, hang))
+        await started.wait()
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        assert breaker.state == "HALF_OPEN"
+        assert breaker.half_open_requests == 0
+
+        for _ in range(breaker.half_open_limit):
+            assert await attempt(breaker, ok) == "ok"
+
+    asyncio.run(scenario())
+    assert breaker.state == "CLOSED"
+
+
+def timeout_error(deadline_bound: bool) -> httpx.TimeoutException:
+    request = httpx.Request("GET", "http://test", extensions={"deadline_bound": deadline_bound})
+    return httpx.ReadTimeout("timed out", request=request)
+
+
+def test_caller_deadline_is_not_a_failure():
+    breaker = make_breaker(threshold=1)
+
+    async def expired():
+        raise DeadlineExceeded()
+
+    async def shortened_timeout():
+        raise timeout_error(deadline_bound=True)
+
+    for func in (expired, shortened_timeout):
+        with pytest.raises((DeadlineExceeded, httpx.TimeoutException)):
+            asyncio.run(attempt(breaker, func))
+    assert breaker.state == "CLOSED"
+
+
+def test_full_timeout_is_a_failure():
+    breaker = make_breaker(threshold=1)
+
+    async def slow():
+        raise timeout_error(deadline_bound=False)
+
+    with pytest.raises(httpx.TimeoutException):
+        asyncio.run(attempt(breaker, slow))
+    assert breaker.state == "OPEN"
+
+
+def test_hedged_latency_samples_the_primary(monkeypatch):
+    from app import circuit_breaker
+    from app.hedge import LatencyTracker
+    from app.retry import RetryBudget
+
+    tracker = LatencyTracker(size=10, percentile=0.5, min_samples=1)
+    monkeypatch.setattr(circuit_breaker, "latency", tracker)
+    monkeypatch.setattr(circuit_breaker, "hedge_budget", RetryBudget(1.0, 0.0, 10))
+    monkeypatch.setattr(circuit_breaker, "hedge_delay", lambda route: 0.02)
+    breaker = make_breaker()
+
+    async def scenario():
+        calls = 0
+
+        async def slow_primary():
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                await asyncio.sleep(0.2)
+            return calls
+
+        assert await circuit_breaker._hedged_attempt("test", breaker, "test", "GET /", slow_primary, (), {}) == 2
+        assert tracker.quantile("GET /") is None
+        await asyncio.sleep(0.3)
+
+    asyncio.run(scenario())
+    # The hedge answered after ~20ms; the estimate must reflect the primary it beat, not the winner.
+    assert tracker.quantile("GET /") >= 0.2
@@ -1,19 +1,25 @@
-from fastapi import APIRouter, Body, Request, Depends
-from .models import LoyaltyInfoResponse
+from fastapi import APIRouter, Body, Header, Path, Request, Response, Depends
+from .models import LoyaltyInfoResponse, BatchUpdateLoyaltyRequest
 from .db import get_conn
+from .cache import loyalty_cache
 import psycopg2.extras
 
-from .auth import verify_jwt, username_from_claims
+from .auth import verify_jwt, verify_service_token, username_from_claims
 
 router = APIRouter(dependencies=[Depends(verify_jwt)])
+internal_router = APIRouter(dependencies=[Depends(verify_service_token)])
 
 
 @router.get("/api/v1/me")
 def user_loyalty(request: Request):
     claims = request.state.claims
-    print(claims)
     username = username_from_claims(claims)
 
+    cached = loyalty_cache.get(username)
+    if cached is not None:
+        return cached
+
+    version = loyalty_cache.version()
     with get_conn() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
         cur.execute("""
             SELECT status, discount, reservation_count as "reservationCount"
@@ -24,31 +30,136 @@ def user_loyalty(request: Request):
     if not row:
         return {}
 
-    return LoyaltyInfoResponse(**row)
+    loyalty = LoyaltyInfoResponse(**row)
+    loyalty_cache.fill(username, loyalty, version)
+    return loyalty
+
+
+def apply_delta(cur, username: str, delta: int):
+    cur.execute("""
+        UPDATE loyalty
+        SET 
+            reservation_count = reservation_count + %s,
+            status = CASE
+                WHEN reservation_count + %s < 10 THEN 'BRONZE'
+                WHEN reservation_count + %s < 20 THEN 'SILVER'
+                ELSE 'GOLD'
+            END
+        WHERE username = %s
+        RETURNING status, discount, reservation_count;
+    """, (delta, delta, delta, username))
+    return cur.fetchone()
+
+
+def cache_loyalty(username: str, row):
+    if row is None:
+        loyalty_cache.invalidate(username)
+    else:
+        loyalty_cache.put(username, LoyaltyInfoResponse(status=row[0], discount=row[1], reservationCount=row[2]))
 
 
 @router.patch("/api/v1/loyalty")
 def update_loyalty(
         request: Request,
         delta: int = Body(..., embed=True),
+        idempotency_key: str | None = Header(None, alias="Idempotency-Key", max_length=80),
 ):
     claims = request.state.claims
     username = username_from_claims(claims)
 
     with get_conn() as conn, conn.cursor() as cur:
+        if idempotency_key is not None:
+            # The key is recorded in the same transaction as the delta, so a repeated request is a no-op.
+            cur.execute("""
+                INSERT INTO loyalty_operation (username, operation_key, delta)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (username, operation_key) DO NOTHING;
+            """, (username, idempotency_key, delta))
+            if cur.rowcount == 0:
+                conn.commit()
+                return {"message": "Loyalty обновлена"}
+
+        row = apply_delta(cur, username, delta)
+        conn.commit()
+
+    cache_loyalty(username, row)
+    return {"message": "Loyalty обновлена"}
+
+
+@router.patch("/api/v1/loyalty/operations/{operationKey}/revert")
+def revert_loyalty_operation(request: Request, operationKey: str = Path(..., max_length=80)):
+    claims = request.state.claims
+    username = username_from_claims(claims)
+
+    with get_conn() as conn, conn.cursor() as cur:
+        # An unknown key leaves a reverted tombstone behind, so an update with that key arriving late is ignored.
+        cur.execute("""
+            INSERT INTO loyalty_operation (username, operation_key, delta, reverted)
+            VALUES (%s, %s, 0, true)
+            ON CONFLICT (username, operation_key) DO UPDATE
+                SET reverted = true
+                WHERE NOT loyalty_operation.reverted
+            RETURNING delta;
+        """, (username, operationKey))
+        reverted = cur.fetchone()
+        row = apply_delta(cur, username, -reverted[0]) if reverted and reverted[0] else None
+        conn.commit()
+
+    if row is not None:
+        cache_loyalty(username, row)
+    return Response(status_code=204)
+
+
+@internal_router.post("/api/v1/loyalty:batchUpdate")
+def batch_update_loyalty(body: BatchUpdateLoyaltyRequest = Body(...)):
+    with get_conn() as conn, conn.cursor() as cur:
+        items = body.items
+        keyed = sorted((item for item in items if item.key is not None), key=lambda i: (i.username, i.key))
+        if keyed:
+            # Keyed items already applied by an earlier delivery are dropped; the keys commit with the deltas.
+            cur.execute("""
+                INSERT INTO loyalty_operation (username, operation_key, delta)
+                SELECT * FROM unnest(%s::varchar[], %s::varchar[], %s::int[])
+                ON CONFLICT (username, operation_key) DO NOTHING
+                RETURNING username, operation_key;
+            """, ([i.username for i in keyed], [i.key for i in keyed], [i.delta for i in keyed]))
+            fresh = set(cur.fetchall())
+            items = [item for item in items if item.key is None or (item.username, item.key) in fresh]
+
+        deltas = {}
+        for item in items:
+            deltas[item.username] = deltas.get(item.username, 0) + item.delta
+
         cur.execute("""
+            WITH locked AS (
+                SELECT id, username
+                FROM loyalty
+                WHERE username = ANY(%(usernames)s)
+                ORDER BY id
+                FOR UPDATE
+            )
             UPDATE loyalty
-            SET 
-                reservation_count = reservation_count + %s,
+            SET
+                reservation_count = loyalty.reservation_count + d.delta,
                 status = CASE
-                    WHEN reservation_count + %s < 10 THEN 'BRONZE'
-                    WHEN reservation_count + %s < 20 THEN 'SILVER'
+                    WHEN loyalty.reservation_count + d.delta < 10 THEN 'BRONZE'
+                    WHEN loyalty.reservation_count + d.delta < 20 THEN 'SILVER'
                     ELSE 'GOLD'
                 END
-            WHERE username = %s
-            RETURNING reservation_count, status;
-        """, (delta, delta, delta, username))
+            FROM locked
+            JOIN unnest(%(usernames)s::varchar[], %(deltas)s::int[]) AS d(username, delta)
+                ON d.username = locked.username
+            WHERE loyalty.id = locked.id
+            RETURNING loyalty.username, loyalty.status, loyalty.discount, loyalty.reservation_count;
+        """, {"usernames": list(deltas), "deltas": list(deltas.values())})
+        rows = cur.fetchall()
 
         conn.commit()
 
-    return {"message": "Loyalty обновлена"}
+    updated = []
+    for username, status, discount, reservation_count in rows:
+        loyalty_cache.put(username, LoyaltyInfoResponse(status=status, discount=discount, reservationCount=reservation_count))
+        updated.append(username)
+
+    missing = set(deltas) - set(updated)
+    return {"updated": updated, "missing": sorted(missing)}
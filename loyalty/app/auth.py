@@ -1,15 +1,125 @@
 import os
 import time
+import hashlib
+import hmac
+import logging
+import threading
 import httpx
 import jwt
-from jwt import PyJWKClient
+from collections import OrderedDict
+from jwt import PyJWKSet
+from .tracing import span
 from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 
 AUTH0_ISSUER = os.environ["AUTH0_ISSUER"]
 AUTH0_JWKS_URI = os.environ["AUTH0_JWKS_URI"]
 
-jwk_client = PyJWKClient(AUTH0_JWKS_URI)
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+JWKS_REFRESH_INTERVAL = float(os.getenv("JWKS_REFRESH_INTERVAL", "30.0"))
+JWKS_FETCH_TIMEOUT = float(os.getenv("JWKS_FETCH_TIMEOUT", "5.0"))
+
+SERVICE_TOKEN = os.getenv("SERVICE_TOKEN")
+
+LOYALTY_SERVICE_TOKEN = os.getenv("LOYALTY_SERVICE_TOKEN")
+
+log = logging.getLogger("auth")
+
+
+class TokenVerifier:
+    def __init__(self, jwks_uri: str, issuer: str, max_size: int = 10000, refresh_interval: float = 30.0):
+        self.jwks_uri = jwks_uri
+        self.issuer = issuer
+        self.max_size = max_size
+        self.refresh_interval = refresh_interval
+
+        self.keys = {}
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.refresh_lock = threading.Lock()
+        self.refresh_done = threading.Event()
+        self.refresh_done.set()
+        self.last_refresh = 0.0
+
+        self.hits = 0
+        self.misses = 0
+
+    def fetch_keys(self):
+        r = httpx.get(self.jwks_uri, timeout=JWKS_FETCH_TIMEOUT)
+        r.raise_for_status()
+        jwk_set = PyJWKSet.from_dict(r.json())
+        self.keys = {k.key_id: k.key for k in jwk_set.keys}
+
+    def prefetch(self):
+        try:
+            self.fetch_keys()
+            self.last_refresh = time.monotonic()
+        except Exception as e:
+            log.warning(f"JWKS prefetch failed: {e}")
+
+    def _refresh_in_background(self):
+        try:
+            self.fetch_keys()
+        except Exception as e:
+            log.warning(f"JWKS refresh failed: {e}")
+        finally:
+            self.refresh_done.set()
+
+    def refresh_keys(self):
+        with self.refresh_lock:
+            if self.refresh_done.is_set():
+                if time.monotonic() - self.last_refresh < self.refresh_interval:
+                    return
+                self.last_refresh = time.monotonic()
+                self.refresh_done.clear()
+                threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        self.refresh_done.wait(JWKS_FETCH_TIMEOUT)
+
+    def signing_key(self, token: str):
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = self.keys.get(kid)
+        if key is None:
+            self.refresh_keys()
+            key = self.keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f"Unknown kid {kid}")
+        return key
+
+    def verify(self, token: str) -> dict:
+        digest = hashlib.sha256(token.encode()).digest()
+        now = time.time()
+
+        with self.lock:
+            entry = self.cache.get(digest)
+            if entry is not None:
+                if entry[0] > now:
+                    self.cache.move_to_end(digest)
+                    self.hits += 1
+                    return entry[1]
+                del self.cache[digest]
+            self.misses += 1
+
+        claims = jwt.decode(
+            token,
+            self.signing_key(token),
+            algorithms=["RS256"],
+            issuer=self.issuer,
+            options={"require": ["exp", "iss"], "verify_aud": False},
+        )
+
+        with self.lock:
+            self.cache[digest] = (claims["exp"], claims)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+        return claims
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"size": len(self.cache), "hits": self.hits, "misses": self.misses}
+
+
+verifier = TokenVerifier(AUTH0_JWKS_URI, AUTH0_ISSUER, max_size=JWT_CACHE_SIZE, refresh_interval=JWKS_REFRESH_INTERVAL)
 
 router = APIRouter()
 
@@ -25,7 +135,23 @@ class AuthorizeResponse(BaseModel):
     expires_in: int
 
 
+def service_claims(request: Request) -> dict | None:
+    # Internal callers (the gateway worker, cached reads) present SERVICE_TOKEN instead of a user JWT,
+    # optionally acting for the user named in X-On-Behalf-Of.
+    token = request.headers.get("X-Service-Token")
+    if token is None:
+        return None
+    if not SERVICE_TOKEN or not hmac.compare_digest(token.encode(), SERVICE_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Некорректная авторизация")
+    return {"sub": request.headers.get("X-On-Behalf-Of"), "service": True}
+
+
 def verify_jwt(request: Request) -> dict:
+    claims = service_claims(request)
+    if claims is not None:
+        request.state.claims = claims
+        return claims
+
     auth = request.headers.get("Authorization")
     if not auth:
         raise HTTPException(status_code=401, detail="Некорректная авторизация")
@@ -33,15 +159,8 @@ def verify_jwt(request: Request) -> dict:
     token = auth.split(" ", 1)[1].strip()
 
     try:
-        signing_key = jwk_client.get_signing_key_from_jwt(token).key
-        claims = jwt.decode(
-            token,
-            signing_key,
-            algorithms=["RS256"],
-            issuer=AUTH0_ISSUER,
-            options={
-                "require": ["exp", "iss"],
-                "verify_aud": False})
+        with span("auth"):
+            claims = verifier.verify(token)
     except:
         raise HTTPException(status_code=401, detail="Некорректная авторизация")
 
@@ -49,5 +168,11 @@ def verify_jwt(request: Request) -> dict:
     return claims
 
 
+def verify_service_token(request: Request):
+    token = request.headers.get("X-Service-Token", "")
+    if not LOYALTY_SERVICE_TOKEN or not hmac.compare_digest(token.encode(), LOYALTY_SERVICE_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Доступ запрещён")
+
+
 def username_from_claims(claims: dict) -> str:
     return claims.get("sub")
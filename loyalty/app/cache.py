@@ -0,0 +1,64 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+LOYALTY_CACHE_SIZE = int(os.getenv("LOYALTY_CACHE_SIZE", "10000"))
+LOYALTY_CACHE_TTL = float(os.getenv("LOYALTY_CACHE_TTL", "30.0"))
+
+
+class TTLCache:
+    def __init__(self, max_size: int = 10000, ttl: float = 30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.writes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def version(self) -> int:
+        with self.lock:
+            return self.writes
+
+    def _store(self, key, value):
+        self.entries[key] = (value, time.monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def fill(self, key, value, version: int):
+        if self.ttl <= 0:
+            return
+        with self.lock:
+            if self.writes == version:
+                self._store(key, value)
+
+    def put(self, key, value):
+        with self.lock:
+            self.writes += 1
+            if self.ttl > 0:
+                self._store(key, value)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.writes += 1
+            self.entries.pop(key, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+loyalty_cache = TTLCache(LOYALTY_CACHE_SIZE, LOYALTY_CACHE_TTL)
@@ -1,6 +1,6 @@
-from typing import Union
+from typing import List, Optional, Union
 from enum import Enum
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 class LoyaltyLevel(str, Enum):
     BRONZE = "BRONZE"
@@ -11,4 +11,13 @@ class LoyaltyLevel(str, Enum):
 class LoyaltyInfoResponse(BaseModel):
     status: LoyaltyLevel
     discount: int
-    reservationCount: int
\ No newline at end of file
+    reservationCount: int
+
+class LoyaltyDelta(BaseModel):
+    username: str = Field(..., max_length=80)
+    delta: int
+    key: Optional[str] = Field(None, max_length=80)
+
+
+class BatchUpdateLoyaltyRequest(BaseModel):
+    items: List[LoyaltyDelta] = Field(..., min_length=1, max_length=1000)
@@ -0,0 +1,9 @@
+CREATE TABLE IF NOT EXISTS loyalty_operation
+(
+    username      VARCHAR(80) NOT NULL,
+    operation_key VARCHAR(80) NOT NULL,
+    delta         INT         NOT NULL,
+    reverted      BOOLEAN     NOT NULL DEFAULT false,
+    created_at    TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    PRIMARY KEY (username, operation_key)
+);
@@ -0,0 +1,23 @@
+-- Hot queries checked by `python -m app.migrate check`: each must be served by an index.
+
+-- name: user_loyalty
+SELECT status, discount, reservation_count
+FROM loyalty
+WHERE username = 'user';
+
+-- name: update_loyalty
+UPDATE loyalty
+SET reservation_count = reservation_count + 1
+WHERE username = 'user';
+
+-- name: batch_update_loyalty
+SELECT id, username
+FROM loyalty
+WHERE username = ANY('{user1,user2}'::varchar[])
+ORDER BY id
+FOR UPDATE;
+
+-- name: loyalty_operation
+SELECT delta, reverted
+FROM loyalty_operation
+WHERE username = 'user' AND operation_key = 'booking:1';
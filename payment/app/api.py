@@ -1,3 +1,4 @@
+from typing import List
 from fastapi import APIRouter, Body, HTTPException, Response, Depends
 from .db import get_conn
 import psycopg2.extras
@@ -28,23 +29,51 @@ def payment_by_id(paymentUid: UUID):
     }
 
 
+@router.post("/api/v1/payments:batchGet")
+def payments_batch_get(paymentUids: List[UUID] = Body(..., embed=True, max_length=100)):
+    if not paymentUids:
+        return {"items": []}
+
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT payment_uid, status, price
+            FROM payment
+            WHERE payment_uid = ANY(%s);
+        """, (list(set(paymentUids)),))
+        rows = cur.fetchall()
+
+    return {
+        "items": [
+            {"paymentUid": payment_uid, "status": status, "price": price}
+            for payment_uid, status, price in rows
+        ]
+    }
+
+
 @router.post("/api/v1/payments")
-def create_payment(price: int = Body(..., embed=True)):
-    payment_uid: UUID = uuid4()
+def create_payment(price: int = Body(..., embed=True), paymentUid: UUID | None = Body(None, embed=True)):
+    # A caller-supplied paymentUid makes the call idempotent: a repeated request returns the payment
+    # created by the first one instead of charging again.
+    payment_uid: UUID = paymentUid or uuid4()
 
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
             """
             INSERT INTO payment (payment_uid, status, price)
             VALUES (%s, %s, %s)
+            ON CONFLICT (payment_uid) DO NOTHING
             """,
             (payment_uid, "PAID", price),
         )
+        status = "PAID"
+        if cur.rowcount == 0:
+            cur.execute("SELECT status, price FROM payment WHERE payment_uid = %s;", (payment_uid,))
+            status, price = cur.fetchone()
         conn.commit()
 
     return {
         "paymentUid": payment_uid,
-        "status": "PAID",
+        "status": status,
         "price": price,
     }
 
@@ -1,10 +1,60 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from psycopg2.errors import QueryCanceled
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
 from .api import router
+from .db import pool, PoolTimeoutError
+from .auth import verifier
+from .tracing import TracingMiddleware
+from .deadline import DeadlineMiddleware, DeadlineExceeded
+from .metrics import MetricsMiddleware, CallbackMetric, render, CONTENT_TYPE
 
-app = FastAPI(title='Payment API')
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    pool.open()
+    verifier.prefetch()
+    yield
+    pool.close()
+
+
+app = FastAPI(title='Payment API', lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(DeadlineMiddleware)
+app.add_middleware(TracingMiddleware)
 app.include_router(router)
 
+CallbackMetric(
+    "jwt_cache_operations",
+    "Verified JWT cache counters",
+    "gauge",
+    ("kind",),
+    lambda: [((k,), v) for k, v in verifier.stats().items()],
+)
+
 
 @app.get("/manage/health")
 def health():
-    return {"status": "ok"}
+    return {"status": "ok", "dbPool": pool.stats(), "jwtCache": verifier.stats()}
+
+
+@app.get("/manage/metrics")
+def metrics():
+    return Response(content=render(), media_type=CONTENT_TYPE)
+
+
+@app.exception_handler(PoolTimeoutError)
+def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    return JSONResponse(
+        status_code=503,
+        content={"message": "База данных недоступна"},
+    )
+
+
+@app.exception_handler(DeadlineExceeded)
+@app.exception_handler(QueryCanceled)
+def deadline_handler(request: Request, exc: Exception):
+    return JSONResponse(
+        status_code=504,
+        content={"message": "Превышено время ожидания"},
+    )
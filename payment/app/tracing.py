@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import queue
+import logging
+import secrets
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+SERVICE_NAME = os.getenv("SERVICE_NAME", "payment")
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH")
+TRACE_EXPORT_QUEUE_SIZE = int(os.getenv("TRACE_EXPORT_QUEUE_SIZE", "10000"))
+
+log = logging.getLogger("tracing")
+
+
+class Trace:
+    def __init__(self, trace_id: str, request_id: str, parent_id: str | None):
+        self.trace_id = trace_id
+        self.request_id = request_id
+        self.parent_id = parent_id
+        self.root_id = secrets.token_hex(8)
+        self.spans = []
+
+
+current_trace: ContextVar[Trace | None] = ContextVar("current_trace", default=None)
+current_span: ContextVar[str | None] = ContextVar("current_span", default=None)
+
+
+def parse_traceparent(value: str | None) -> tuple[str | None, str | None]:
+    if not value:
+        return None, None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None, None
+    try:
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None, None
+    return parts[1], parts[2]
+
+
+def trace_headers() -> dict:
+    trace = current_trace.get()
+    if trace is None:
+        return {}
+    parent = current_span.get() or trace.root_id
+    return {"traceparent": f"00-{trace.trace_id}-{parent}-01", "X-Request-Id": trace.request_id}
+
+
+@contextmanager
+def span(name: str, **attrs):
+    trace = current_trace.get()
+    if trace is None:
+        yield attrs
+        return
+
+    span_id = secrets.token_hex(8)
+    parent_id = current_span.get() or trace.root_id
+    token = current_span.set(span_id)
+    started = time.time()
+    start = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        current_span.reset(token)
+        trace.spans.append({
+            "name": name,
+            "spanId": span_id,
+            "parentId": parent_id,
+            "start": started,
+            "duration": time.perf_counter() - start,
+            "attrs": attrs,
+        })
+
+
+def server_timing(trace: Trace, total: float) -> str:
+    durations = {}
+    for item in list(trace.spans):
+        durations[item["name"]] = durations.get(item["name"], 0.0) + item["duration"]
+    entries = [f"{name};dur={value * 1000:.2f}" for name, value in durations.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+class SpanExporter:
+    def __init__(self, path: str | None, max_size: int = 10000):
+        self.path = path
+        self.queue = queue.Queue(maxsize=max_size)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="span-exporter", daemon=True)
+                self.thread.start()
+
+    def export(self, trace: Trace, root: dict):
+        if not self.path:
+            return
+        self.start()
+        try:
+            self.queue.put_nowait((trace, root))
+        except queue.Full:
+            self.dropped += 1
+
+    def lines(self, trace: Trace, root: dict):
+        for item in [root] + list(trace.spans):
+            yield json.dumps({
+                "service": SERVICE_NAME,
+                "traceId": trace.trace_id,
+                "requestId": trace.request_id,
+                **item,
+            }, ensure_ascii=False, default=str)
+
+    def run(self):
+        while True:
+            trace, root = self.queue.get()
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("\n".join(self.lines(trace, root)) + "\n")
+                    while True:
+                        try:
+                            trace, root = self.queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        f.write("\n".join(self.lines(trace, root)) + "\n")
+            except OSError as e:
+                log.warning(f"Span export to {self.path} failed: {e}")
+
+
+exporter = SpanExporter(TRACE_EXPORT_PATH, max_size=TRACE_EXPORT_QUEUE_SIZE)
+
+
+class TracingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        trace_id, parent_id = parse_traceparent(headers.get("traceparent"))
+        request_id = headers.get("x-request-id", "")[:128] or secrets.token_hex(16)
+        trace = Trace(trace_id or secrets.token_hex(16), request_id, parent_id)
+
+        trace_token = current_trace.set(trace)
+        span_token = current_span.set(trace.root_id)
+        started = time.time()
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                timing = server_timing(trace, time.perf_counter() - start)
+                message = {
+                    **message,
+                    "headers": list(message.get("headers", [])) + [
+                        (b"server-timing", timing.encode("latin-1")),
+                        (b"x-request-id", trace.request_id.encode("latin-1")),
+                    ],
+                }
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_span.reset(span_token)
+            current_trace.reset(trace_token)
+            route = scope.get("route")
+            exporter.export(trace, {
+                "name": f"{scope['method']} {route.path if route is not None else scope['path']}",
+                "spanId": trace.root_id,
+                "parentId": trace.parent_id,
+                "start": started,
+                "duration": time.perf_counter() - start,
+                "attrs": {"status": status[0]},
+            })
@@ -0,0 +1,16 @@
+-- Hot queries checked by `python -m app.migrate check`: each must be served by an index.
+
+-- name: payment_by_uid
+SELECT *
+FROM payment
+WHERE payment_uid = '00000000-0000-0000-0000-000000000000';
+
+-- name: payments_batch_get
+SELECT payment_uid, status, price
+FROM payment
+WHERE payment_uid = ANY('{00000000-0000-0000-0000-000000000000,00000000-0000-0000-0000-000000000001}'::uuid[]);
+
+-- name: cancel_payment
+UPDATE payment
+SET status = 'CANCELED'
+WHERE payment_uid = '00000000-0000-0000-0000-000000000000';
@@ -1,7 +1,9 @@
 #!/usr/bin/env bash
 set -e
 
-export VARIANT="v2"
-export SCRIPT_PATH=/docker-entrypoint-initdb.d/
 export PGPASSWORD=postgres
-psql -f "$SCRIPT_PATH/scripts/db-$VARIANT.sql"
+
+# Schemas belong to the services: each one applies its migrations/ on startup (python -m app.migrate up).
+for db in reservations payments loyalties; do
+  psql -v ON_ERROR_STOP=1 --username postgres -c "CREATE DATABASE $db OWNER program;"
+done
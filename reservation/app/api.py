@@ -1,8 +1,12 @@
+import os
+from datetime import date
 from fastapi import APIRouter, Body, Depends, HTTPException, Response, Request
 from uuid import uuid4
 from .models import *
 import psycopg2.extras
 from .db import get_conn
+from .cache import hotels_total
+from .inventory import stay_nights, reserve_rooms, release_rooms, availability
 from .utils import *
 from .auth import verify_jwt, username_from_claims
 
@@ -10,28 +14,148 @@ psycopg2.extras.register_uuid()
 router = APIRouter(dependencies=[Depends(verify_jwt)])
 
 
+HOTELS_TOTAL_APPROX_MIN = int(os.getenv("HOTELS_TOTAL_APPROX_MIN", "100000"))
+
+# Column lists follow the field order of the records in utils, led by the ids the handlers keep for themselves.
+HOTEL_COLUMNS = """
+    hotels.id, hotels.hotel_uid, hotels.name, hotels.country, hotels.city, hotels.address, hotels.stars, hotels.price
+"""
+
+RESERVATION_COLUMNS = """
+    reservation.id, reservation.reservation_uid,
+    hotels.hotel_uid, hotels.name, hotels.country || ', ' || hotels.city || ', ' || hotels.address, hotels.stars,
+    reservation.start_date, reservation.end_date, reservation.status, reservation.payment_uid
+"""
+
+
+def count_hotels() -> int:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = 'hotels';")
+        row = cur.fetchone()
+        if row and row[0] >= HOTELS_TOTAL_APPROX_MIN:
+            return row[0]
+
+        cur.execute("SELECT COUNT(*) FROM hotels;")
+        return cur.fetchone()[0]
+
+
 @router.get("/api/v1/hotels")
 def list_hotels(params: GetHotelsQuery = Depends()):
-    if not params.page:
-        params.page = 1
-    offset = (params.page - 1) * params.size
-    with get_conn() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-        cur.execute("SELECT COUNT(*) AS total FROM hotels;")
-        total = cur.fetchone()["total"]
+    total = hotels_total.get(count_hotels)
+
+    if params.cursor is not None:
+        try:
+            after_id = decode_cursor(params.cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Некорректный курсор")
+
+        with get_conn() as conn, conn.cursor() as cur:
+            cur.execute(
+                f"""
+                SELECT {HOTEL_COLUMNS}
+                FROM hotels
+                WHERE id > %s
+                ORDER BY id
+                LIMIT %s;
+                """,
+                (after_id, params.size),
+            )
+            rows = cur.fetchall()
+    else:
+        if not params.page:
+            params.page = 1
+        offset = (params.page - 1) * params.size
+        with get_conn() as conn, conn.cursor() as cur:
+            cur.execute(
+                f"""
+                SELECT {HOTEL_COLUMNS}
+                FROM hotels
+                ORDER BY id
+                LIMIT %s OFFSET %s;
+                """,
+                (params.size, offset),
+            )
+            rows = cur.fetchall()
 
+    items = [build_hotel_from_row(r) for r in rows]
+    next_cursor = encode_cursor(rows[-1][0]) if len(rows) == params.size else None
+    return json_response({"total": total, "items": items, "nextCursor": next_cursor})
+
+
+@router.get("/api/v1/hotels/search")
+def search_hotels(params: SearchHotelsQuery = Depends()):
+    sort = params.sortBy.value
+    descending = params.order == SortOrder.DESC
+
+    conditions = [f"{sort} IS NOT NULL"]
+    args = []
+    for column, op, value in (
+            ("city", "=", params.city),
+            ("country", "=", params.country),
+            ("stars", ">=", params.starsMin),
+            ("stars", "<=", params.starsMax),
+            ("price", ">=", params.priceMin),
+            ("price", "<=", params.priceMax),
+    ):
+        if value is not None:
+            conditions.append(f"{column} {op} %s")
+            args.append(value)
+
+    if params.cursor is not None:
+        try:
+            after_value, after_id = decode_search_cursor(params.cursor, sort, params.order.value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Некорректный курсор")
+        conditions.append(f"({sort}, id) {'<' if descending else '>'} (%s, %s)")
+        args.extend((after_value, after_id))
+
+    # The page is picked from the (city|country|-, sort, id) covering indexes alone;
+    # only the rows that made it into the page are read from the table.
+    direction = "DESC" if descending else "ASC"
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
-            """
-            SELECT *
-            FROM hotels
-            ORDER BY id
-            LIMIT %s OFFSET %s;
+            f"""
+            WITH page AS (
+                SELECT id, {sort}
+                FROM hotels
+                WHERE {" AND ".join(conditions)}
+                ORDER BY {sort} {direction}, id {direction}
+                LIMIT %s
+            )
+            SELECT {HOTEL_COLUMNS}
+            FROM page
+            JOIN hotels ON hotels.id = page.id
+            ORDER BY page.{sort} {direction}, page.id {direction};
             """,
-            (params.size, offset),
+            (*args, params.size),
         )
         rows = cur.fetchall()
 
     items = [build_hotel_from_row(r) for r in rows]
-    return {"total": total, "items": items}
+    next_cursor = encode_search_cursor(sort, params.order.value, getattr(items[-1], sort), rows[-1][0]) if len(rows) == params.size else None
+    return json_response({"items": items, "nextCursor": next_cursor})
+
+
+@router.get("/api/v1/hotels/{hotelUid}/availability")
+def hotel_availability(hotelUid: UUID, params: AvailabilityQuery = Depends()):
+    try:
+        with get_conn() as conn:
+            nights = availability(conn, hotelUid, params.startDate, params.endDate)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректные даты бронирования")
+
+    if not nights:
+        raise HTTPException(status_code=404, detail="Отель не найден")
+
+    free_rooms = min(free for _, free in nights)
+    return json_response({
+        "hotelUid": hotelUid,
+        "startDate": params.startDate,
+        "endDate": params.endDate,
+        "available": free_rooms > 0,
+        "freeRooms": free_rooms,
+        "nights": [{"date": night, "freeRooms": free} for night, free in nights],
+    })
 
 
 @router.get("/api/v1/me")
@@ -39,31 +163,72 @@ def user_reservations(request: Request):
     claims = request.state.claims
     username = username_from_claims(claims)
 
-    with get_conn() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
-            """
-            SELECT reservation.*, hotels.*
+            f"""
+            SELECT {RESERVATION_COLUMNS}
             FROM reservation
             JOIN hotels ON reservation.hotel_id = hotels.id
-            WHERE reservation.username = %s;
+            WHERE reservation.username = %s
+            ORDER BY reservation.id;
             """,
             (username,),
         )
-        rows = cur.fetchall()
+        reservations = [build_reservation_from_row(r) for r in cur]
+
+    return json_response({"reservations": reservations})
 
-    if not rows:
-        return {"reservations": []}
+
+@router.get("/api/v1/reservations")
+def list_user_reservations(request: Request, params: GetReservationsQuery = Depends()):
+    claims = request.state.claims
+    username = username_from_claims(claims)
+
+    conditions = ["reservation.username = %s"]
+    args = [username]
+
+    if params.cursor is not None:
+        try:
+            after_id = decode_cursor(params.cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Некорректный курсор")
+        conditions.append("reservation.id > %s")
+        args.append(after_id)
+    if params.status is not None:
+        conditions.append("reservation.status = %s")
+        args.append(params.status.value)
+    if params.dateFrom is not None:
+        conditions.append("reservation.end_date >= %s")
+        args.append(params.dateFrom)
+    if params.dateTo is not None:
+        conditions.append("reservation.start_date <= %s")
+        args.append(params.dateTo)
+
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT {RESERVATION_COLUMNS}
+            FROM reservation
+            JOIN hotels ON reservation.hotel_id = hotels.id
+            WHERE {" AND ".join(conditions)}
+            ORDER BY reservation.id
+            LIMIT %s;
+            """,
+            (*args, params.size),
+        )
+        rows = cur.fetchall()
 
     reservations = [build_reservation_from_row(r) for r in rows]
-    return {"reservations": reservations}
+    next_cursor = encode_cursor(rows[-1][0]) if len(rows) == params.size else None
+    return json_response({"reservations": reservations, "nextCursor": next_cursor})
 
 
 @router.get("/api/v1/hotel/{hotelUid}")
 def get_hotel(hotelUid: UUID):
-    with get_conn() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
-            """
-            SELECT *
+            f"""
+            SELECT {HOTEL_COLUMNS}
             FROM hotels
             WHERE hotel_uid = %s;
             """,
@@ -74,7 +239,7 @@ def get_hotel(hotelUid: UUID):
     if not row:
         return {}
 
-    return build_hotel_from_row(row)
+    return json_response(build_hotel_from_row(row))
 
 
 @router.post("/api/v1/reservations")
@@ -103,33 +268,44 @@ def create_reservation(
             detail="Не хватает обязательных полей для создания бронирования",
         )
 
-    with get_conn() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+    holds_room = status_value == ReservationStatus.PAID.value
+    try:
+        nights = (date.fromisoformat(str(start_date)[:10]), date.fromisoformat(str(end_date)[:10]))
+        stay_nights(*nights)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректные даты бронирования")
+
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute("SELECT id FROM hotels WHERE hotel_uid = %s;", (hotel_uid,))
         hotel_row = cur.fetchone()
         if not hotel_row:
             raise HTTPException(status_code=400, detail="Отель не найден")
+        hotel_id = hotel_row[0]
 
         cur.execute(
             """
             INSERT INTO reservation
-                (reservation_uid, username, payment_uid, hotel_id, status, start_date, end_date)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
+                (reservation_uid, username, payment_uid, hotel_id, status, start_date, end_date, holds_room)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
             RETURNING reservation_uid, status, start_date, end_date;
             """,
             (
                 reservation_uid,
                 username,
                 payment_uid,
-                hotel_row["id"],
+                hotel_id,
                 status_value,
                 start_date,
                 end_date,
+                holds_room,
             ),
         )
         row = cur.fetchone()
+        if holds_room:
+            reserve_rooms(conn, hotel_id, *nights)
         conn.commit()
 
-    return build_created_reservation_response(row, hotel_uid, payment_uid)
+    return json_response(build_created_reservation_response(row, hotel_uid, payment_uid))
 
 
 @router.get("/api/v1/reservations/{reservationUid}")
@@ -140,22 +316,23 @@ def get_reservation(
     claims = request.state.claims
     username = username_from_claims(claims)
 
-    with get_conn() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+    with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
-            """
-            SELECT reservation.*, hotels.*
+            f"""
+            SELECT {RESERVATION_COLUMNS}
             FROM reservation
             JOIN hotels ON reservation.hotel_id = hotels.id
-            WHERE reservation.reservation_uid = %s;
+            WHERE reservation.reservation_uid = %s
+              AND reservation.username = %s;
             """,
-            (reservationUid,),
+            (reservationUid, username),
         )
         row = cur.fetchone()
 
-    if not row or row["username"] != username:
+    if not row:
         raise HTTPException(status_code=404, detail="Билет не найден")
 
-    return build_reservation_from_row(row)
+    return json_response(build_reservation_from_row(row))
 
 
 @router.patch("/api/v1/reservations/{reservationUid}/cancel", status_code=204)
@@ -168,15 +345,158 @@ def cancel_reservation(
 
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute("""
-            UPDATE reservation
-            SET status = 'CANCELED'
+            SELECT id, hotel_id, holds_room, start_date, end_date
+            FROM reservation
             WHERE reservation_uid = %s
-              AND username = %s;
+              AND username = %s
+            FOR UPDATE;
         """, (reservationUid, username))
+        row = cur.fetchone()
 
-        if cur.rowcount == 0:
+        if row is None:
             raise HTTPException(status_code=404, detail="Бронь не найдена")
 
+        reservation_id, hotel_id, holds_room, start_date, end_date = row
+        cur.execute("UPDATE reservation SET status = 'CANCELED', holds_room = false WHERE id = %s;", (reservation_id,))
+        if holds_room:
+            release_rooms(conn, hotel_id, start_date.date(), end_date.date())
         conn.commit()
 
     return Response(status_code=204)
+
+
+BOOKING_COLUMNS = """
+    booking.id, booking.hotel_id, booking.booking_uid, hotels.hotel_uid, booking.start_date, booking.end_date,
+    booking.status, booking.step, booking.price, booking.discount, booking.payment_uid, booking.reservation_uid,
+    booking.error
+"""
+
+
+def select_booking(cur, booking_uid: UUID, username: str, for_update: bool = False) -> tuple[int, int, Booking]:
+    cur.execute(
+        f"""
+        SELECT {BOOKING_COLUMNS}
+        FROM booking
+        JOIN hotels ON booking.hotel_id = hotels.id
+        WHERE booking.booking_uid = %s AND booking.username = %s
+        {"FOR UPDATE OF booking" if for_update else ""};
+        """,
+        (booking_uid, username),
+    )
+    row = cur.fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="Бронирование не найдено")
+    return build_booking_from_row(row)
+
+
+@router.post("/api/v1/bookings", status_code=201)
+def create_booking(request: Request, body: CreateReservationRequest = Body(...)):
+    claims = request.state.claims
+    username = username_from_claims(claims)
+
+    try:
+        stay_nights(date.fromisoformat(body.startDate[:10]), date.fromisoformat(body.endDate[:10]))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректные даты бронирования")
+
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT id FROM hotels WHERE hotel_uid = %s;", (body.hotelUid,))
+        hotel_row = cur.fetchone()
+        if not hotel_row:
+            raise HTTPException(status_code=400, detail="Отель не найден")
+
+        booking_uid = uuid4()
+        cur.execute(
+            """
+            INSERT INTO booking (booking_uid, username, hotel_id, start_date, end_date)
+            VALUES (%s, %s, %s, %s, %s);
+            """,
+            (booking_uid, username, hotel_row[0], body.startDate, body.endDate),
+        )
+        _, _, booking = select_booking(cur, booking_uid, username)
+        conn.commit()
+
+    return json_response(booking, status_code=201)
+
+
+@router.get("/api/v1/bookings/{bookingUid}")
+def get_booking(request: Request, bookingUid: UUID):
+    claims = request.state.claims
+    username = username_from_claims(claims)
+
+    with get_conn() as conn, conn.cursor() as cur:
+        _, _, booking = select_booking(cur, bookingUid, username)
+
+    return json_response(booking)
+
+
+@router.patch("/api/v1/bookings/{bookingUid}")
+def update_booking(request: Request, bookingUid: UUID, body: UpdateBookingRequest = Body(...)):
+    claims = request.state.claims
+    username = username_from_claims(claims)
+
+    changes = {
+        "status": body.status.value if body.status else None,
+        "step": body.step.value if body.step else None,
+        "payment_uid": body.paymentUid,
+        "price": body.price,
+        "discount": body.discount,
+        "error": body.error,
+    }
+    changes = {k: v for k, v in changes.items() if v is not None}
+
+    with get_conn() as conn, conn.cursor() as cur:
+        booking_id, _, booking = select_booking(cur, bookingUid, username, for_update=True)
+        if booking.status == BookingStatus.COMPLETED.value:
+            raise HTTPException(status_code=409, detail="Бронирование уже завершено")
+        if booking.status == BookingStatus.FAILED.value and changes.get("status", "FAILED") != "FAILED":
+            raise HTTPException(status_code=409, detail="Бронирование уже отменено")
+
+        if changes:
+            assignments = ", ".join(f"{column} = %s" for column in changes)
+            cur.execute(
+                f"UPDATE booking SET {assignments}, updated_at = now() WHERE id = %s;",
+                (*changes.values(), booking_id),
+            )
+            _, _, booking = select_booking(cur, bookingUid, username)
+        conn.commit()
+
+    return json_response(booking)
+
+
+@router.post("/api/v1/bookings/{bookingUid}/complete")
+def complete_booking(request: Request, bookingUid: UUID):
+    claims = request.state.claims
+    username = username_from_claims(claims)
+
+    with get_conn() as conn, conn.cursor() as cur:
+        booking_id, hotel_id, booking = select_booking(cur, bookingUid, username, for_update=True)
+        if booking.status == BookingStatus.COMPLETED.value:
+            return json_response(booking)
+        if booking.status == BookingStatus.FAILED.value:
+            raise HTTPException(status_code=409, detail="Бронирование уже отменено")
+        if not booking.paymentUid:
+            raise HTTPException(status_code=409, detail="Бронирование ещё не оплачено")
+
+        reservation_uid = uuid4()
+        cur.execute(
+            """
+            INSERT INTO reservation
+                (reservation_uid, username, payment_uid, hotel_id, status, start_date, end_date, holds_room)
+            VALUES (%s, %s, %s, %s, 'PAID', %s, %s, true);
+            """,
+            (reservation_uid, username, booking.paymentUid, hotel_id, booking.startDate, booking.endDate),
+        )
+        cur.execute(
+            """
+            UPDATE booking
+            SET status = 'COMPLETED', step = 'COMPLETED', reservation_uid = %s, updated_at = now()
+            WHERE id = %s;
+            """,
+            (reservation_uid, booking_id),
+        )
+        reserve_rooms(conn, hotel_id, booking.startDate, booking.endDate)
+        _, _, booking = select_booking(cur, bookingUid, username)
+        conn.commit()
+
+    return json_response(booking)
@@ -0,0 +1,35 @@
+import os
+import threading
+import time
+
+HOTELS_TOTAL_TTL = float(os.getenv("HOTELS_TOTAL_TTL", "60.0"))
+
+
+class TTLValue:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.value = None
+        self.expires_at = 0.0
+        self.lock = threading.Lock()
+
+    def get(self, loader):
+        now = time.monotonic()
+        if self.value is not None and now < self.expires_at:
+            return self.value
+
+        with self.lock:
+            if self.value is not None and time.monotonic() < self.expires_at:
+                return self.value
+            self.value = loader()
+            self.expires_at = time.monotonic() + self.ttl
+            return self.value
+
+    def invalidate(self):
+        with self.lock:
+            self.value = None
+            self.expires_at = 0.0
+
+
+# The service has no hotel write path; anything that adds or removes hotels must call hotels_total.invalidate().
+# Hotel pages cached by the gateway are dropped through its POST /manage/cache/hotels/invalidate.
+hotels_total = TTLValue(HOTELS_TOTAL_TTL)
@@ -0,0 +1,96 @@
+import os
+from datetime import date, timedelta
+
+RESERVATION_MAX_NIGHTS = int(os.getenv("RESERVATION_MAX_NIGHTS", "60"))
+
+
+class RoomsUnavailable(Exception):
+    def __init__(self, days: list[date]):
+        self.days = days
+        super().__init__(f"No rooms left on {', '.join(d.isoformat() for d in days)}")
+
+
+def stay_nights(start_date: date, end_date: date) -> list[date]:
+    count = (end_date - start_date).days
+    if count <= 0:
+        raise ValueError("endDate must be after startDate")
+    if count > RESERVATION_MAX_NIGHTS:
+        raise ValueError(f"Stay is longer than {RESERVATION_MAX_NIGHTS} nights")
+    return [start_date + timedelta(days=i) for i in range(count)]
+
+
+def reserve_rooms(conn, hotel_id: int, start_date: date, end_date: date):
+    # Inventory rows are created lazily from hotels.rooms. Every booker locks the nights of its stay
+    # in date order, so overlapping stays queue on the same rows instead of deadlocking, and the
+    # booked < total check sees the latest row version once the lock is granted.
+    # Callers run this last before commit to keep the row locks short.
+    nights = stay_nights(start_date, end_date)
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO room_inventory (hotel_id, day, total)
+            SELECT hotels.id, night::date, hotels.rooms
+            FROM hotels, generate_series(%(start)s::date, %(end)s::date - 1, interval '1 day') AS night
+            WHERE hotels.id = %(hotel_id)s
+            ON CONFLICT (hotel_id, day) DO NOTHING;
+
+            WITH locked AS (
+                SELECT day, total, booked
+                FROM room_inventory
+                WHERE hotel_id = %(hotel_id)s AND day >= %(start)s AND day < %(end)s
+                ORDER BY day
+                FOR UPDATE
+            )
+            UPDATE room_inventory
+            SET booked = room_inventory.booked + 1
+            FROM locked
+            WHERE room_inventory.hotel_id = %(hotel_id)s
+              AND room_inventory.day = locked.day
+              AND locked.booked < locked.total
+            RETURNING room_inventory.day;
+            """,
+            {"hotel_id": hotel_id, "start": start_date, "end": end_date},
+        )
+        reserved = {row[0] for row in cur.fetchall()}
+
+    if len(reserved) != len(nights):
+        raise RoomsUnavailable([night for night in nights if night not in reserved])
+
+
+def release_rooms(conn, hotel_id: int, start_date: date, end_date: date):
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            WITH locked AS (
+                SELECT day
+                FROM room_inventory
+                WHERE hotel_id = %(hotel_id)s AND day >= %(start)s AND day < %(end)s
+                ORDER BY day
+                FOR UPDATE
+            )
+            UPDATE room_inventory
+            SET booked = room_inventory.booked - 1
+            FROM locked
+            WHERE room_inventory.hotel_id = %(hotel_id)s
+              AND room_inventory.day = locked.day
+              AND room_inventory.booked > 0;
+            """,
+            {"hotel_id": hotel_id, "start": start_date, "end": end_date},
+        )
+
+
+def availability(conn, hotel_uid, start_date: date, end_date: date) -> list[tuple[date, int]]:
+    stay_nights(start_date, end_date)
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT night::date, COALESCE(room_inventory.total, hotels.rooms) - COALESCE(room_inventory.booked, 0)
+            FROM hotels
+            CROSS JOIN generate_series(%(start)s::date, %(end)s::date - 1, interval '1 day') AS night
+            LEFT JOIN room_inventory ON room_inventory.hotel_id = hotels.id AND room_inventory.day = night::date
+            WHERE hotels.hotel_uid = %(hotel_uid)s
+            ORDER BY night;
+            """,
+            {"hotel_uid": hotel_uid, "start": start_date, "end": end_date},
+        )
+        return [(night, max(free, 0)) for night, free in cur.fetchall()]
@@ -0,0 +1,189 @@
+import os
+import re
+import sys
+import glob
+import hashlib
+import logging
+import argparse
+import psycopg2
+from .db import DB_DSN
+
+MIGRATIONS_PATH = os.getenv("MIGRATIONS_PATH", os.path.join(os.path.dirname(os.path.dirname(__file__)), "migrations"))
+HOT_QUERIES_FILE = "hot_queries.sql"
+
+MIGRATION_NAME = re.compile(r"^(\d+)_(\w+)\.sql$")
+QUERY_NAME = re.compile(r"^--\s*name:\s*(\S+)\s*$", re.MULTILINE)
+
+LOCK_ID = 0x5E4E3A  # pg_advisory_lock key shared by every replica running migrations
+BASELINE_VERSION = 1  # schema the pre-runner images created by piping 01_init.sql through psql
+
+log = logging.getLogger("migrate")
+
+
+class MigrationError(Exception):
+    pass
+
+
+def discover(path: str = MIGRATIONS_PATH) -> list[tuple[int, str, str]]:
+    migrations = {}
+    for file in sorted(glob.glob(os.path.join(path, "*.sql"))):
+        match = MIGRATION_NAME.match(os.path.basename(file))
+        if not match:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise MigrationError(f"Duplicate migration version {version}: {migrations[version][1]}, {match.group(2)}")
+        with open(file, encoding="utf-8") as f:
+            migrations[version] = (version, match.group(2), f.read())
+    return [migrations[v] for v in sorted(migrations)]
+
+
+def checksum(sql: str) -> str:
+    return hashlib.sha256(sql.encode("utf-8")).hexdigest()
+
+
+def applied_versions(cur) -> dict[int, str]:
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations
+        (
+            version    INT PRIMARY KEY,
+            name       VARCHAR(255)             NOT NULL,
+            checksum   VARCHAR(64)              NOT NULL,
+            applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+        );
+    """)
+    cur.execute("SELECT version, checksum FROM schema_migrations;")
+    return dict(cur.fetchall())
+
+
+def unversioned_schema(cur) -> bool:
+    cur.execute("""
+        SELECT EXISTS (
+            SELECT 1
+            FROM information_schema.tables
+            WHERE table_schema = current_schema()
+              AND table_name <> 'schema_migrations'
+        );
+    """)
+    return cur.fetchone()[0]
+
+
+def baseline(cur, migrations: list[tuple[int, str, str]]) -> dict[int, str]:
+    # Databases bootstrapped before the runner already hold the initial schema but have no history;
+    # record the baseline as applied instead of re-running its CREATE TABLEs against them.
+    stamped = {}
+    for version, name, sql in migrations:
+        if version > BASELINE_VERSION:
+            break
+        log.info(f"Existing schema found, recording {version}_{name} as applied")
+        cur.execute(
+            "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s);",
+            (version, name, checksum(sql)),
+        )
+        stamped[version] = checksum(sql)
+    return stamped
+
+
+def migrate(dsn: str = DB_DSN, path: str = MIGRATIONS_PATH) -> list[int]:
+    migrations = discover(path)
+    done = []
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s);", (LOCK_ID,))
+            applied = applied_versions(cur)
+            if not applied and unversioned_schema(cur):
+                applied = baseline(cur, migrations)
+            conn.commit()
+
+            for version, name, sql in migrations:
+                digest = checksum(sql)
+                if version in applied:
+                    if applied[version] != digest:
+                        log.warning(f"Migration {version}_{name} changed after it was applied")
+                    continue
+
+                log.info(f"Applying migration {version}_{name}")
+                try:
+                    cur.execute(sql)
+                    cur.execute(
+                        "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s);",
+                        (version, name, digest),
+                    )
+                    conn.commit()
+                except psycopg2.Error as e:
+                    conn.rollback()
+                    raise MigrationError(f"Migration {version}_{name} failed: {e}") from e
+                done.append(version)
+
+            cur.execute("SELECT pg_advisory_unlock(%s);", (LOCK_ID,))
+            conn.commit()
+    finally:
+        conn.close()
+    return done
+
+
+def hot_queries(path: str = MIGRATIONS_PATH) -> list[tuple[str, str]]:
+    file = os.path.join(path, HOT_QUERIES_FILE)
+    if not os.path.exists(file):
+        return []
+    with open(file, encoding="utf-8") as f:
+        parts = QUERY_NAME.split(f.read())
+    return [(name, sql.strip().rstrip(";")) for name, sql in zip(parts[1::2], parts[2::2])]
+
+
+def seq_scans(plan: dict) -> list[str]:
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan.get("Relation Name", "?"))
+    for child in plan.get("Plans", ()):
+        found.extend(seq_scans(child))
+    return found
+
+
+def check(dsn: str = DB_DSN, path: str = MIGRATIONS_PATH) -> dict[str, list[str]]:
+    # With enable_seqscan off the planner still falls back to a sequential scan when no index fits,
+    # so the result does not depend on how many rows the tables hold right now.
+    failures = {}
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET LOCAL enable_seqscan = off;")
+            for name, sql in hot_queries(path):
+                cur.execute(f"EXPLAIN (FORMAT JSON) {sql}")
+                scans = seq_scans(cur.fetchone()[0][0]["Plan"])
+                if scans:
+                    failures[name] = scans
+                log.info(f"{name}: {'seq scan on ' + ', '.join(scans) if scans else 'ok'}")
+        conn.rollback()
+    finally:
+        conn.close()
+    return failures
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Apply versioned schema migrations")
+    parser.add_argument("command", nargs="?", choices=("up", "check"), default="up")
+    parser.add_argument("--dsn", default=DB_DSN)
+    parser.add_argument("--path", default=MIGRATIONS_PATH)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+
+    try:
+        if args.command == "up":
+            done = migrate(args.dsn, args.path)
+            log.info(f"Applied {len(done)} migration(s)" if done else "Schema is up to date")
+            return 0
+
+        failures = check(args.dsn, args.path)
+        for name, scans in failures.items():
+            log.error(f"{name} falls back to a sequential scan on {', '.join(scans)}")
+        return 1 if failures else 0
+    except (MigrationError, psycopg2.Error) as e:
+        log.error(str(e).strip())
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
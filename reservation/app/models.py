@@ -1,3 +1,6 @@
+from typing import Optional
+from datetime import date
+from enum import Enum
 from uuid import UUID
 from pydantic import BaseModel, Field
 
@@ -11,3 +14,68 @@ class CreateReservationRequest(BaseModel):
 class GetHotelsQuery(BaseModel):
     page: int = Field(0, ge=0)
     size: int = Field(1, ge=1, le=100)
+    cursor: Optional[str] = None
+
+
+class HotelSortField(str, Enum):
+    PRICE = "price"
+    STARS = "stars"
+
+
+class SortOrder(str, Enum):
+    ASC = "asc"
+    DESC = "desc"
+
+
+class SearchHotelsQuery(BaseModel):
+    city: Optional[str] = Field(None, max_length=80)
+    country: Optional[str] = Field(None, max_length=80)
+    starsMin: Optional[int] = Field(None, ge=0)
+    starsMax: Optional[int] = Field(None, ge=0)
+    priceMin: Optional[int] = Field(None, ge=0)
+    priceMax: Optional[int] = Field(None, ge=0)
+    sortBy: HotelSortField = HotelSortField.PRICE
+    order: SortOrder = SortOrder.ASC
+    size: int = Field(20, ge=1, le=100)
+    cursor: Optional[str] = None
+
+
+class AvailabilityQuery(BaseModel):
+    startDate: date
+    endDate: date
+
+
+class ReservationStatus(str, Enum):
+    PAID = "PAID"
+    CANCELED = "CANCELED"
+
+
+class GetReservationsQuery(BaseModel):
+    size: int = Field(50, ge=1, le=100)
+    cursor: Optional[str] = None
+    status: Optional[ReservationStatus] = None
+    dateFrom: Optional[date] = None
+    dateTo: Optional[date] = None
+
+
+class BookingStatus(str, Enum):
+    PENDING = "PENDING"
+    COMPLETED = "COMPLETED"
+    FAILED = "FAILED"
+
+
+class BookingStep(str, Enum):
+    ACCEPTED = "ACCEPTED"
+    PAYMENT_CREATED = "PAYMENT_CREATED"
+    LOYALTY_UPDATED = "LOYALTY_UPDATED"
+    COMPLETED = "COMPLETED"
+    COMPENSATED = "COMPENSATED"
+
+
+class UpdateBookingRequest(BaseModel):
+    status: Optional[BookingStatus] = None
+    step: Optional[BookingStep] = None
+    paymentUid: Optional[UUID] = None
+    price: Optional[int] = None
+    discount: Optional[int] = None
+    error: Optional[str] = Field(None, max_length=255)
@@ -1,46 +1,118 @@
-from typing import Dict, Any
+import base64
+import binascii
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, Dict, Tuple
 from uuid import UUID
+from fastapi import Response
+from pydantic_core import to_json
 
 
-def build_hotel_from_row(row: Dict[str, Any]) -> Dict[str, Any]:
-    return {
-        "hotelUid": row["hotel_uid"],
-        "name": row["name"],
-        "country": row["country"],
-        "city": row["city"],
-        "address": row["address"],
-        "stars": row["stars"],
-        "price": row["price"],
-    }
+# Response records: field names are the API's, so to_json serializes them as-is without an intermediate dict.
+@dataclass(slots=True)
+class Hotel:
+    hotelUid: UUID
+    name: str
+    country: str
+    city: str
+    address: str
+    stars: int | None
+    price: int
 
 
-def build_reservation_from_row(row: Dict[str, Any]) -> Dict[str, Any]:
-    full_address = f"{row['country']}, {row['city']}, {row['address']}"
-    return {
-        "reservationUid": row["reservation_uid"],
-        "hotel": {
-            "hotelUid": row["hotel_uid"],
-            "name": row["name"],
-            "fullAddress": full_address,
-            "stars": row["stars"],
-        },
-        "startDate": row["start_date"].isoformat() if row["start_date"] else None,
-        "endDate": row["end_date"].isoformat() if row["end_date"] else None,
-        "status": row["status"],
-        "paymentUid": row["payment_uid"],
-    }
+@dataclass(slots=True)
+class ReservationHotel:
+    hotelUid: UUID
+    name: str
+    fullAddress: str
+    stars: int | None
+
+
+@dataclass(slots=True)
+class Reservation:
+    reservationUid: UUID
+    hotel: ReservationHotel
+    startDate: datetime | None
+    endDate: datetime | None
+    status: str
+    paymentUid: UUID
+
+
+@dataclass(slots=True)
+class Booking:
+    bookingUid: UUID
+    hotelUid: UUID
+    startDate: date
+    endDate: date
+    status: str
+    step: str
+    price: int | None
+    discount: int | None
+    paymentUid: UUID | None
+    reservationUid: UUID | None
+    error: str | None
+
+
+def json_response(content: Any, status_code: int = 200) -> Response:
+    # Encodes records, UUIDs and datetimes natively in one pass instead of jsonable_encoder + json.dumps.
+    return Response(content=to_json(content), status_code=status_code, media_type="application/json")
+
+
+def build_hotel_from_row(row: tuple) -> Hotel:
+    # Rows lead with hotels.id, which only feeds the cursor.
+    return Hotel(*row[1:])
+
+
+def build_reservation_from_row(row: tuple) -> Reservation:
+    _, reservation_uid, hotel_uid, name, full_address, stars, *rest = row
+    return Reservation(reservation_uid, ReservationHotel(hotel_uid, name, full_address, stars), *rest)
 
 
 def build_created_reservation_response(
-        row: Dict[str, Any],
+        row: Tuple[UUID, str, datetime, datetime],
         hotel_uid: UUID,
         payment_uid: UUID,
 ) -> Dict[str, Any]:
+    reservation_uid, status, start_date, end_date = row
     return {
-        "reservationUid": str(row["reservation_uid"]),
-        "hotelUid": str(hotel_uid),
-        "startDate": row["start_date"].isoformat() if row["start_date"] else None,
-        "endDate": row["end_date"].isoformat() if row["end_date"] else None,
-        "status": row["status"],
-        "paymentUid": str(payment_uid),
+        "reservationUid": reservation_uid,
+        "hotelUid": hotel_uid,
+        "startDate": start_date,
+        "endDate": end_date,
+        "status": status,
+        "paymentUid": payment_uid,
     }
+
+
+def build_booking_from_row(row: tuple) -> Tuple[int, int, Booking]:
+    # Rows lead with booking.id and booking.hotel_id, which the handlers need but the response does not.
+    booking_id, hotel_id, booking_uid, hotel_uid, start_date, end_date, *rest = row
+    return booking_id, hotel_id, Booking(booking_uid, hotel_uid, start_date.date(), end_date.date(), *rest)
+
+
+def encode_cursor(last_id: int | str) -> str:
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError(f"Invalid cursor {cursor}")
+
+
+def encode_search_cursor(sort: str, order: str, value: int, last_id: int) -> str:
+    return encode_cursor(f"{sort}:{order}:{value}:{last_id}")
+
+
+def decode_search_cursor(cursor: str, sort: str, order: str) -> tuple[int, int]:
+    # The keyset position only means something under the ordering it was taken from.
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, cursor_order, value, last_id = base64.urlsafe_b64decode(padded.encode()).decode().split(":")
+        if (cursor_sort, cursor_order) != (sort, order):
+            raise ValueError(f"Cursor was issued for {cursor_sort} {cursor_order}")
+        return int(value), int(last_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError(f"Invalid cursor {cursor}")
@@ -0,0 +1,20 @@
+CREATE TABLE IF NOT EXISTS booking
+(
+    id              SERIAL PRIMARY KEY,
+    booking_uid     uuid UNIQUE NOT NULL,
+    username        VARCHAR(80) NOT NULL,
+    hotel_id        INT REFERENCES hotels (id),
+    start_date      TIMESTAMP WITH TIME ZONE NOT NULL,
+    end_date        TIMESTAMP WITH TIME ZONE NOT NULL,
+    status          VARCHAR(20) NOT NULL DEFAULT 'PENDING'
+        CHECK (status IN ('PENDING', 'COMPLETED', 'FAILED')),
+    step            VARCHAR(20) NOT NULL DEFAULT 'ACCEPTED'
+        CHECK (step IN ('ACCEPTED', 'PAYMENT_CREATED', 'LOYALTY_UPDATED', 'COMPLETED', 'COMPENSATED')),
+    discount        INT,
+    price           INT,
+    payment_uid     uuid,
+    reservation_uid uuid,
+    error           VARCHAR(255),
+    created_at      TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    updated_at      TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
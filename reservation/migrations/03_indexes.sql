@@ -0,0 +1,5 @@
+CREATE UNIQUE INDEX IF NOT EXISTS hotels_hotel_uid_key ON hotels (hotel_uid);
+CREATE UNIQUE INDEX IF NOT EXISTS reservation_reservation_uid_key ON reservation (reservation_uid);
+CREATE UNIQUE INDEX IF NOT EXISTS booking_booking_uid_key ON booking (booking_uid);
+
+CREATE INDEX IF NOT EXISTS reservation_username_id_idx ON reservation (username, id);
@@ -0,0 +1,6 @@
+CREATE INDEX IF NOT EXISTS hotels_city_price_idx ON hotels (city, price, id) INCLUDE (country, stars);
+CREATE INDEX IF NOT EXISTS hotels_city_stars_idx ON hotels (city, stars, id) INCLUDE (country, price);
+CREATE INDEX IF NOT EXISTS hotels_country_price_idx ON hotels (country, price, id) INCLUDE (city, stars);
+CREATE INDEX IF NOT EXISTS hotels_country_stars_idx ON hotels (country, stars, id) INCLUDE (city, price);
+CREATE INDEX IF NOT EXISTS hotels_price_idx ON hotels (price, id) INCLUDE (city, country, stars);
+CREATE INDEX IF NOT EXISTS hotels_stars_idx ON hotels (stars, id) INCLUDE (city, country, price);
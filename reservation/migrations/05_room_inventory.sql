@@ -0,0 +1,15 @@
+ALTER TABLE hotels
+    ADD COLUMN IF NOT EXISTS rooms INT NOT NULL DEFAULT 10 CHECK (rooms >= 0);
+
+ALTER TABLE reservation
+    ADD COLUMN IF NOT EXISTS holds_room BOOLEAN NOT NULL DEFAULT false;
+
+CREATE TABLE IF NOT EXISTS room_inventory
+(
+    hotel_id INT  NOT NULL REFERENCES hotels (id),
+    day      DATE NOT NULL,
+    total    INT  NOT NULL CHECK (total >= 0),
+    booked   INT  NOT NULL DEFAULT 0 CHECK (booked >= 0),
+    PRIMARY KEY (hotel_id, day),
+    CHECK (booked <= total)
+);
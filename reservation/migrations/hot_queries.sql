@@ -0,0 +1,115 @@
+-- Hot queries checked by `python -m app.migrate check`: each must be served by an index.
+-- They repeat the SQL in app/api.py with sample parameters; keep the two in step.
+
+-- name: hotels_page
+SELECT hotels.id, hotels.hotel_uid, hotels.name, hotels.country, hotels.city, hotels.address, hotels.stars, hotels.price
+FROM hotels
+WHERE id > 0
+ORDER BY id
+LIMIT 10;
+
+-- name: hotel_by_uid
+SELECT hotels.id, hotels.hotel_uid, hotels.name, hotels.country, hotels.city, hotels.address, hotels.stars, hotels.price
+FROM hotels
+WHERE hotel_uid = '049161bb-badd-4fa8-9d90-87c9a82b0668';
+
+-- name: user_reservations
+SELECT reservation.id, reservation.reservation_uid,
+       hotels.hotel_uid, hotels.name, hotels.country || ', ' || hotels.city || ', ' || hotels.address, hotels.stars,
+       reservation.start_date, reservation.end_date, reservation.status, reservation.payment_uid
+FROM reservation
+JOIN hotels ON reservation.hotel_id = hotels.id
+WHERE reservation.username = 'user'
+  AND reservation.id > 0
+ORDER BY reservation.id
+LIMIT 10;
+
+-- name: reservation_by_uid
+SELECT reservation.id, reservation.reservation_uid,
+       hotels.hotel_uid, hotels.name, hotels.country || ', ' || hotels.city || ', ' || hotels.address, hotels.stars,
+       reservation.start_date, reservation.end_date, reservation.status, reservation.payment_uid
+FROM reservation
+JOIN hotels ON reservation.hotel_id = hotels.id
+WHERE reservation.reservation_uid = '00000000-0000-0000-0000-000000000000'
+  AND reservation.username = 'user';
+
+-- name: cancel_reservation
+SELECT id, hotel_id, holds_room, start_date, end_date
+FROM reservation
+WHERE reservation_uid = '00000000-0000-0000-0000-000000000000'
+  AND username = 'user'
+FOR UPDATE;
+
+-- name: booking_by_uid
+SELECT booking.id, booking.hotel_id, booking.booking_uid, hotels.hotel_uid, booking.start_date, booking.end_date,
+       booking.status, booking.step, booking.price, booking.discount, booking.payment_uid, booking.reservation_uid,
+       booking.error
+FROM booking
+JOIN hotels ON booking.hotel_id = hotels.id
+WHERE booking.booking_uid = '00000000-0000-0000-0000-000000000000' AND booking.username = 'user'
+FOR UPDATE OF booking;
+
+-- name: search_hotels_city_by_price
+WITH page AS (
+    SELECT id, price
+    FROM hotels
+    WHERE price IS NOT NULL AND city = 'Москва' AND stars >= 3 AND price <= 20000
+      AND (price, id) > (5000, 10)
+    ORDER BY price ASC, id ASC
+    LIMIT 20
+)
+SELECT hotels.id, hotels.hotel_uid, hotels.name, hotels.country, hotels.city, hotels.address, hotels.stars, hotels.price
+FROM page
+JOIN hotels ON hotels.id = page.id
+ORDER BY page.price ASC, page.id ASC;
+
+-- name: search_hotels_country_by_stars
+WITH page AS (
+    SELECT id, stars
+    FROM hotels
+    WHERE stars IS NOT NULL AND country = 'Россия' AND price >= 1000
+      AND (stars, id) < (5, 100)
+    ORDER BY stars DESC, id DESC
+    LIMIT 20
+)
+SELECT hotels.id, hotels.hotel_uid, hotels.name, hotels.country, hotels.city, hotels.address, hotels.stars, hotels.price
+FROM page
+JOIN hotels ON hotels.id = page.id
+ORDER BY page.stars DESC, page.id DESC;
+
+-- name: search_hotels_by_price
+WITH page AS (
+    SELECT id, price
+    FROM hotels
+    WHERE price IS NOT NULL AND stars <= 4
+    ORDER BY price DESC, id DESC
+    LIMIT 20
+)
+SELECT hotels.id, hotels.hotel_uid, hotels.name, hotels.country, hotels.city, hotels.address, hotels.stars, hotels.price
+FROM page
+JOIN hotels ON hotels.id = page.id
+ORDER BY page.price DESC, page.id DESC;
+
+-- name: reserve_rooms
+WITH locked AS (
+    SELECT day, total, booked
+    FROM room_inventory
+    WHERE hotel_id = 1 AND day >= '2026-01-01' AND day < '2026-01-08'
+    ORDER BY day
+    FOR UPDATE
+)
+UPDATE room_inventory
+SET booked = room_inventory.booked + 1
+FROM locked
+WHERE room_inventory.hotel_id = 1
+  AND room_inventory.day = locked.day
+  AND locked.booked < locked.total
+RETURNING room_inventory.day;
+
+-- name: hotel_availability
+SELECT night::date, COALESCE(room_inventory.total, hotels.rooms) - COALESCE(room_inventory.booked, 0)
+FROM hotels
+CROSS JOIN generate_series('2026-01-01'::date, '2026-01-08'::date - 1, interval '1 day') AS night
+LEFT JOIN room_inventory ON room_inventory.hotel_id = hotels.id AND room_inventory.day = night::date
+WHERE hotels.hotel_uid = '049161bb-badd-4fa8-9d90-87c9a82b0668'
+ORDER BY night;